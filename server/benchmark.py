@@ -0,0 +1,555 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from server import AsyncHttpServer, HttpServer, Request, RequestReader, ServerLog
+
+
+class ServerBenchmark:
+    """
+    A class where an object runs the benchmarks of the server and collects their results
+
+    The benchmarks run offline: the functions are timed in this process on a copy of the files of the server, and
+    the end-to-end benchmarks send requests over the loopback interface to a server running in a child process.
+    The results are a dictionary that is written as JSON, so runs can be compared with ServerBenchmark.compare.
+    Only runs on the same machine with the same options are comparable.
+
+    Attributes
+    ----------
+    ServerBenchmark.FILES: tuple
+        a static tuple with the files of the server that are copied to the document root of the benchmarks
+    ServerBenchmark.REQUEST_HEADER: str
+        a static string with the header of the GET request the functions are timed with
+    ServerBenchmark.METHODS: tuple
+        a static tuple with the HTTP commands of the end-to-end benchmarks
+    ServerBenchmark.UPLOAD_BODY: bytes
+        a static bytes object with the body of every PUT and POST request of the end-to-end benchmarks
+    ServerBenchmark.CONCURRENCY: tuple
+        a static tuple with the default numbers of clients sending requests at the same time
+    ServerBenchmark.DURATION: float
+        a static float specifying the default seconds every end-to-end benchmark runs
+    ServerBenchmark.REPEAT: int
+        a static integer specifying the default number of times every function is timed, the best time counts
+    ServerBenchmark.TOLERANCE: float
+        a static float specifying the default fraction a result may be worse than the baseline
+    ServerBenchmark.ENVIRONMENT: tuple
+        a static tuple with the keys of the results describing the run, which have to match for runs to be compared
+    engine: str
+        either "threading" or "asyncio", the engine of the server of the end-to-end benchmarks
+    duration: float
+        the seconds every end-to-end benchmark runs
+    concurrency: tuple
+        the numbers of clients sending requests at the same time in the end-to-end benchmarks
+    repeat: int
+        the number of times every function is timed
+    """
+
+    FILES: tuple = ("index.html", "bad_request.html", "not_found.html", "internal_server_error.html",
+                    "not_modified.html", "sea.jpg")
+    REQUEST_HEADER: str = "GET /index.html HTTP/1.1\r\nHost: localhost:5055\r\nUser-Agent: benchmark\r\n" \
+                          "Accept: text/html,application/xhtml+xml\r\nAccept-Encoding: gzip, deflate\r\n" \
+                          "Accept-Language: en-US,en;q=0.5\r\nConnection: keep-alive\r\n\r\n"
+    METHODS: tuple = ("GET", "HEAD", "PUT", "POST")
+    UPLOAD_BODY: bytes = b"<html><body>benchmark</body></html>\n"
+    CONCURRENCY: tuple = (1, 8, 32)
+    DURATION: float = 2.0
+    REPEAT: int = 5
+    TOLERANCE: float = 0.1
+    ENVIRONMENT: tuple = ("engine", "python", "platform")
+
+    engine: str
+    duration: float
+    concurrency: tuple
+    repeat: int
+
+    def __init__(self, engine: str = "threading", duration: float = DURATION, concurrency: tuple = CONCURRENCY,
+                 repeat: int = REPEAT):
+        self.engine = engine
+        self.duration = duration
+        self.concurrency = concurrency
+        self.repeat = repeat
+
+    def run(self, end_to_end: bool = True) -> dict:
+        """Run all benchmarks in a temporary document root
+
+        Parameters
+        ----------
+        end_to_end: bool
+            False to only time the functions
+
+        Returns
+        -------
+        dict
+            Returns the results, with the ns per call of every function under "micro" and the results of every
+            HTTP command and concurrency under "end_to_end"
+        """
+        results = {
+            "engine": self.engine,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        source = os.path.dirname(os.path.abspath(__file__))
+        cwd = os.getcwd()
+
+        with tempfile.TemporaryDirectory() as docroot:
+            for file in ServerBenchmark.FILES:
+                shutil.copy(os.path.join(source, file), docroot)
+
+            # the server resolves every path against the current directory
+            os.chdir(docroot)
+
+            try:
+                results["micro"] = self.run_micro()
+
+                if end_to_end:
+                    results["end_to_end"] = self.run_end_to_end(docroot)
+            finally:
+                os.chdir(cwd)
+
+        return results
+
+    @staticmethod
+    def measure(function, repeat: int) -> dict:
+        """Time a function without arguments
+
+        Parameters
+        ----------
+        function
+            The function to time
+        repeat: int
+            The number of times to time a loop calling the function, the fastest loop counts
+
+        Returns
+        -------
+        dict
+            Returns the nanoseconds per call under "ns_per_op" and the number of calls per loop under "ops"
+        """
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat, number))
+        return {"ns_per_op": best / number * 1e9, "ops": number}
+
+    def run_micro(self) -> dict:
+        """Time the functions reading, parsing and routing requests and building responses
+
+        Returns
+        -------
+        dict
+            Returns a dictionary mapping the name of every benchmark to the result of ServerBenchmark.measure
+        """
+        server = HttpServer()
+        server.ipv4 = "127.0.0.1"
+        server.addr = (server.ipv4, HttpServer.PORT)
+        server.add_stream_handler("/stream", lambda stream_request: [b"benchmark\n"])
+        request = Request.parse(ServerBenchmark.REQUEST_HEADER)
+        conditional = Request.parse(ServerBenchmark.REQUEST_HEADER[:-2]
+                                    + "If-Modified-Since: Thu, 18 Mar 2021 20:44:30 GMT\r\n\r\n")
+        raw_header = ServerBenchmark.REQUEST_HEADER.encode(HttpServer.FORMAT)
+        sender, receiver = socket.socketpair()
+        reader = RequestReader(receiver, HttpServer.HEADER)
+        entry = server.file_cache.get("index.html")
+
+        def read_header():
+            sender.sendall(raw_header)
+            return HttpServer.get_request_header(reader)
+
+        def route():
+            # the steps create_get_or_head_response takes before it builds the response
+            if HttpServer.is_valid_http_request(conditional):
+                info = server.document_index.get(HttpServer.get_file(conditional)[1:])
+                return info is not None and HttpServer.is_modified(conditional, info.etag, info.mtime_ns)
+
+        def respond(function, *args):
+            def create_response():
+                function(*args).close()
+
+            return create_response
+
+        benchmarks = {
+            "get_request_header": read_header,
+            "Request.parse": lambda: Request.parse(ServerBenchmark.REQUEST_HEADER),
+            "route": route,
+            "is_modified": lambda: HttpServer.is_modified(conditional, entry.etag, entry.mtime_ns),
+            "create_get_or_head_response cached": respond(server.create_get_or_head_response, "GET", request,
+                                                          "/index.html"),
+            "create_get_or_head_response file": respond(server.create_get_or_head_response, "GET", request,
+                                                        "/sea.jpg"),
+            "create_200_response": respond(HttpServer.create_200_response, "/index.html"),
+            "create_200_response_from_cache": respond(HttpServer.create_200_response_from_cache, entry),
+            "create_206_response": respond(HttpServer.create_206_response, "/index.html", [(0, 99)], entry.size,
+                                           entry.mtime_ns, None, entry.body),
+            "create_201_response": respond(server.create_201_response, "/index.html"),
+            "create_204_response": respond(HttpServer.create_204_response),
+            "create_304_response": respond(HttpServer.create_304_response),
+            "create_400_response": respond(HttpServer.create_400_response),
+            "create_404_response": respond(HttpServer.create_404_response),
+            "create_413_response": respond(HttpServer.create_413_response),
+            "create_416_response": respond(HttpServer.create_416_response, entry.size),
+            "create_417_response": respond(HttpServer.create_417_response),
+            "create_429_response": respond(HttpServer.create_429_response),
+            "create_431_response": respond(HttpServer.create_431_response),
+            "create_500_response": respond(HttpServer.create_500_response),
+            "create_501_response": respond(HttpServer.create_501_response),
+            "create_503_response": respond(HttpServer.create_503_response),
+            "create_metrics_response": respond(server.create_metrics_response, "GET"),
+            "create_stream_response": respond(server.create_stream_response, "GET", request, "/stream"),
+            # only HEAD answers without starting a profile
+            "create_profile_response": respond(server.create_profile_response, "HEAD", "/profile"),
+        }
+        results = {}
+
+        try:
+            for name, function in benchmarks.items():
+                results[name] = ServerBenchmark.measure(function, self.repeat)
+        finally:
+            sender.close()
+            receiver.close()
+            server.close()
+
+        return results
+
+    @staticmethod
+    def serve(engine: str, docroot: str, workers: int, connection):
+        """Run a server on a free port of the loopback interface, meant to be the target of a child process
+
+        Parameters
+        ----------
+        engine: str
+            Either "threading" or "asyncio"
+        docroot: str
+            The directory to serve the files of
+        workers: int
+            The number of worker threads of the threading engine, enough to manage every client at once
+        connection: multiprocessing.connection.Connection
+            The end of a pipe to send the address of the server to once it listens
+        """
+        os.chdir(docroot)
+        ServerLog.configure(logging.WARNING, 0)
+        server_class = AsyncHttpServer if engine == "asyncio" else HttpServer
+        server = server_class(workers=workers, max_requests=sys.maxsize)
+        server.connect(ipv4="127.0.0.1", port=0)
+        connection.send(server.addr)
+        connection.close()
+        server.loop()
+
+    def run_end_to_end(self, docroot: str) -> dict:
+        """Measure the throughput and latency of every HTTP command at every concurrency
+
+        Every client keeps one connection open and sends its next request as soon as the previous response is
+        received. PUT and POST requests of different clients go to different files.
+
+        Parameters
+        ----------
+        docroot: str
+            The directory the server serves the files of
+
+        Returns
+        -------
+        dict
+            Returns a dictionary mapping every HTTP command to a dictionary mapping every concurrency, as a string,
+            to the requests per second, the 50th and 99th percentile of the latency in milliseconds and the number
+            of failed requests
+        """
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=ServerBenchmark.serve, daemon=True,
+                                          args=(self.engine, docroot, max(self.concurrency), sender))
+        process.start()
+        sender.close()
+        results = {}
+
+        try:
+            address = tuple(receiver.recv())
+
+            for command in ServerBenchmark.METHODS:
+                results[command] = {}
+
+                for clients in self.concurrency:
+                    results[command][str(clients)] = self.run_load(address, command, clients)
+        finally:
+            receiver.close()
+            process.terminate()
+            process.join()
+
+        return results
+
+    def run_load(self, address: tuple, command: str, clients: int) -> dict:
+        """Send requests with the given HTTP command from several clients at once for the configured duration
+
+        Parameters
+        ----------
+        address: tuple
+            The IPv4 address and port of the server
+        command: str
+            The HTTP command of every request
+        clients: int
+            The number of clients
+
+        Returns
+        -------
+        dict
+            Returns the requests per second, the 50th and 99th percentile of the latency in milliseconds and the
+            number of failed requests
+        """
+        latencies = [[] for _ in range(clients)]
+        errors = [0] * clients
+        barrier = threading.Barrier(clients + 1)
+        threads = []
+
+        for index in range(clients):
+            if command == "PUT" or command == "POST":
+                header = command + " /bench" + str(index) + ".html HTTP/1.1\r\nHost: localhost\r\n" \
+                    "Content-Type: text/html\r\nContent-Length: " + str(len(ServerBenchmark.UPLOAD_BODY)) + "\r\n\r\n"
+                raw_request = header.encode(HttpServer.FORMAT) + ServerBenchmark.UPLOAD_BODY
+            else:
+                raw_request = (command + " /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n").encode(HttpServer.FORMAT)
+
+            thread = threading.Thread(target=ServerBenchmark.load, daemon=True,
+                                      args=(address, raw_request, command == "HEAD", barrier, self.duration,
+                                            latencies[index], errors, index))
+            thread.start()
+            threads.append(thread)
+
+        barrier.wait()
+        start = time.perf_counter()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+        merged = sorted(latency for client_latencies in latencies for latency in client_latencies)
+        return {
+            "requests_per_second": len(merged) / elapsed,
+            "p50_ms": ServerBenchmark.percentile(merged, 0.5) * 1000,
+            "p99_ms": ServerBenchmark.percentile(merged, 0.99) * 1000,
+            "errors": sum(errors),
+        }
+
+    @staticmethod
+    def load(address: tuple, raw_request: bytes, head: bool, barrier: threading.Barrier, duration: float,
+             latencies: list, errors: list, index: int):
+        """Send the same request over one connection until the duration has passed, meant to run in a thread
+
+        Parameters
+        ----------
+        address: tuple
+            The IPv4 address and port of the server
+        raw_request: bytes
+            The request to send
+        head: bool
+            True if the responses have no body
+        barrier: threading.Barrier
+            The barrier all clients wait at, so they start at the same time
+        duration: float
+            The seconds to send requests for
+        latencies: list
+            The list to append the seconds every successful request took to
+        errors: list
+            The list counting the failed requests of every client
+        index: int
+            The index of this client in errors
+        """
+        conn = socket.create_connection(address)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray()
+        barrier.wait()
+        deadline = time.perf_counter() + duration
+
+        try:
+            while True:
+                start = time.perf_counter()
+
+                if start >= deadline:
+                    break
+
+                conn.sendall(raw_request)
+                status_code = ServerBenchmark.read_response(conn, buffer, head)
+                end = time.perf_counter()
+
+                if 200 <= status_code < 300:
+                    latencies.append(end - start)
+                else:
+                    errors[index] += 1
+        except OSError:
+            errors[index] += 1
+        finally:
+            conn.close()
+
+    @staticmethod
+    def read_response(conn: socket.socket, buffer: bytearray, head: bool) -> int:
+        """Receive a response with a Content-Length header, keeping the bytes after it in the buffer
+
+        Parameters
+        ----------
+        conn: socket.socket
+            The connection to the server
+        buffer: bytearray
+            The bytes received after the previous response
+        head: bool
+            True if the response has no body
+
+        Returns
+        -------
+        int
+            Returns the status code of the response
+
+        Raises
+        ------
+        ConnectionError
+            If the server closed the connection
+        """
+        end_header_ind = buffer.find(RequestReader.TERMINATOR)
+
+        while end_header_ind == -1:
+            ServerBenchmark.receive(conn, buffer)
+            end_header_ind = buffer.find(RequestReader.TERMINATOR)
+
+        header = buffer[:end_header_ind].decode(HttpServer.FORMAT)
+        content_length = 0
+
+        if not head:
+            for line in header.split("\r\n")[1:]:
+                name, _, value = line.partition(":")
+
+                if name.lower() == "content-length":
+                    content_length = int(value)
+
+        end = end_header_ind + len(RequestReader.TERMINATOR) + content_length
+
+        while len(buffer) < end:
+            ServerBenchmark.receive(conn, buffer)
+
+        del buffer[:end]
+        return int(header.split(" ", 2)[1])
+
+    @staticmethod
+    def receive(conn: socket.socket, buffer: bytearray):
+        """Append the next chunk received from the server to the buffer"""
+        data = conn.recv(HttpServer.HEADER)
+
+        if not data:
+            raise ConnectionError("server closed the connection")
+
+        buffer += data
+
+    @staticmethod
+    def percentile(values: list, fraction: float) -> float:
+        """Returns the value below which the given fraction of the sorted values lie, 0 if there are none"""
+        if not values:
+            return 0.0
+
+        return values[min(round(fraction * (len(values) - 1)), len(values) - 1)]
+
+    @staticmethod
+    def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+        """Compare results with the results of an earlier run
+
+        Only the benchmarks in both runs are compared. A function regressed if it is more than the tolerance
+        slower, an end-to-end benchmark if its requests per second dropped or its 99th percentile latency grew by
+        more than the tolerance. Runs with another engine, Python version or platform are not compared at all.
+
+        Parameters
+        ----------
+        results: dict
+            The results of this run, as returned by ServerBenchmark.run
+        baseline: dict
+            The results of the earlier run
+        tolerance: float
+            The fraction a result may be worse than the baseline, for example 0.1 for 10%
+
+        Returns
+        -------
+        list
+            Returns a message describing every regression, an empty list if there are none
+
+        Raises
+        ------
+        ValueError
+            If the runs differ in any of ServerBenchmark.ENVIRONMENT
+        """
+        for key in ServerBenchmark.ENVIRONMENT:
+            if results.get(key) != baseline.get(key):
+                raise ValueError("the runs can not be compared, %s is %s but was %s in the baseline"
+                                 % (key, results.get(key), baseline.get(key)))
+
+        regressions = []
+
+        for name, result in results.get("micro", {}).items():
+            old = baseline.get("micro", {}).get(name)
+
+            if old is not None and result["ns_per_op"] > old["ns_per_op"] * (1 + tolerance):
+                regressions.append("%s: %.0f ns per call, was %.0f ns" % (name, result["ns_per_op"],
+                                                                          old["ns_per_op"]))
+
+        for command, by_concurrency in results.get("end_to_end", {}).items():
+            for clients, result in by_concurrency.items():
+                old = baseline.get("end_to_end", {}).get(command, {}).get(clients)
+
+                if old is None:
+                    continue
+
+                if result["requests_per_second"] * (1 + tolerance) < old["requests_per_second"]:
+                    regressions.append("%s with %s clients: %.0f requests per second, was %.0f" % (
+                        command, clients, result["requests_per_second"], old["requests_per_second"]))
+
+                if result["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+                    regressions.append("%s with %s clients: p99 latency of %.3f ms, was %.3f ms" % (
+                        command, clients, result["p99_ms"], old["p99_ms"]))
+
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the HTTP server, run from the directory of the server")
+    parser.add_argument("--engine", choices=["threading", "asyncio"], default="threading",
+                        help="engine of the server of the end-to-end benchmarks")
+    parser.add_argument("--duration", type=float, default=ServerBenchmark.DURATION,
+                        help="seconds every end-to-end benchmark runs")
+    parser.add_argument("--concurrency", type=lambda value: tuple(int(part) for part in value.split(",")),
+                        default=ServerBenchmark.CONCURRENCY,
+                        help="comma separated numbers of clients sending requests at the same time")
+    parser.add_argument("--repeat", type=int, default=ServerBenchmark.REPEAT,
+                        help="number of times every function is timed, the fastest time counts")
+    parser.add_argument("--micro-only", action="store_true", help="skip the end-to-end benchmarks")
+    parser.add_argument("--output", help="file to write the results to as JSON, standard output by default")
+    parser.add_argument("--baseline", help="JSON file with the results of an earlier run to compare with, the exit "
+                                           "code is 1 if any benchmark regressed and 2 if the runs used another "
+                                           "engine, Python version or platform")
+    parser.add_argument("--tolerance", type=float, default=ServerBenchmark.TOLERANCE,
+                        help="fraction a result may be worse than the baseline before it counts as a regression")
+    arguments = parser.parse_args()
+
+    benchmark = ServerBenchmark(arguments.engine, arguments.duration, arguments.concurrency, arguments.repeat)
+    benchmark_results = benchmark.run(not arguments.micro_only)
+
+    if arguments.output is None:
+        json.dump(benchmark_results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, "w") as output:
+            json.dump(benchmark_results, output, indent=2)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+
+        try:
+            benchmark_regressions = ServerBenchmark.compare(benchmark_results, baseline_results, arguments.tolerance)
+        except ValueError as e:
+            print("error: " + str(e), file=sys.stderr)
+            sys.exit(2)
+
+        for regression in benchmark_regressions:
+            print("regression: " + regression, file=sys.stderr)
+
+        sys.exit(1 if benchmark_regressions else 0)
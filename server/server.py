@@ -1,633 +1,5143 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import ctypes
+import ctypes.util
+import email.utils
+import errno
+import functools
+import gzip
+import itertools
+import logging
+import logging.handlers
+import mmap
 import socket
 import threading
-import datetime
 import os
-import re
+import posixpath
+import queue
+import select
+import shutil
+import signal
+import stat
+import struct
+import sys
+import tempfile
+import time
+import urllib.parse
+import zlib
 
 
-class HttpServer:
+class RequestReader:
     """
-    A class where an object represents an HTTP server
+    A class where an object buffers the data received from a single client
+
+    Data is received in large chunks straight into a reusable buffer. Bytes received after the end of a header are
+    kept in the buffer, so they can be used for the body of the request or for the next request on the connection.
 
     Attributes
     ----------
-    HttpServer.PORT: int
-        a static integer specifying the port to use for communication between server and clients
-    HttpServer.HEADER: int
-        a static integer specifying the maximum bytes to be received at once
-    HttpServer.FORMAT: str
-        a static string representing the format used to decode received data
-    HttpServer.DISCONNECT_MESSAGE: str
-        a static string representing the message the client has to send to disconnect from the server
-    ipv4: str
-        a string representing the IPv4 address of the server
-    addr: tuple
-        a tuple of length 2 with the first position being the IPv4 address and the second being the port
+    RequestReader.TERMINATOR: bytes
+        a static bytes object marking the end of a request header
+    conn_socket: socket.socket
+        the socket of the client to receive data from
+    buffer: bytearray
+        the buffer holding the received data
+    start: int
+        the index of the first byte in the buffer that has not been consumed yet
+    end: int
+        the index right after the last byte received in the buffer
+    scanned: int
+        the index up to which the buffer has already been searched for the terminator
+    received_at: float
+        the value of time.perf_counter() when the first byte of the last header read was available
+    """
+
+    TERMINATOR: bytes = b"\r\n\r\n"
+
+    conn_socket: socket.socket
+    buffer: bytearray
+    start: int
+    end: int
+    scanned: int
+    received_at: float
+
+    def __init__(self, conn_socket: socket.socket, chunk_size: int):
+        self.conn_socket = conn_socket
+        self.buffer = bytearray(chunk_size)
+        self.start = 0
+        self.end = 0
+        self.scanned = 0
+        self.received_at = 0.0
+
+    def buffered(self) -> int:
+        """Returns the number of received bytes that have not been consumed yet"""
+        return self.end - self.start
+
+    def fill(self) -> int:
+        """Receive the next chunk of data from the client into the buffer
+
+        Consumed bytes at the front of the buffer are reclaimed first. The buffer only grows if it is completely
+        filled with unconsumed bytes.
+
+        Returns
+        -------
+        int
+            Returns the number of bytes received
+
+        Raises
+        ------
+        ConnectionError
+            If the client closed the connection
+        """
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        elif self.end == len(self.buffer):
+            if self.start > 0:
+                pending = self.end - self.start
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+                self.scanned = max(self.scanned - self.start, 0)
+                self.start, self.end = 0, pending
+            else:
+                self.buffer.extend(bytes(len(self.buffer)))
+
+        received = self.conn_socket.recv_into(memoryview(self.buffer)[self.end:])
+
+        if received == 0:
+            raise ConnectionError("client closed the connection")
+
+        self.end += received
+        return received
+
+    def find_terminator(self) -> int:
+        """Search the unconsumed data for the end of a header
+
+        Only the bytes that were not searched before are scanned, together with the last few bytes of the previous
+        search in case the terminator was split over two chunks.
+
+        Returns
+        -------
+        int
+            Returns the index right after the terminator, or -1 if the buffer does not contain a full header
+        """
+        begin = max(self.start, self.scanned - len(RequestReader.TERMINATOR) + 1)
+        end_header_ind = self.buffer.find(RequestReader.TERMINATOR, begin, self.end)
+
+        if end_header_ind == -1:
+            self.scanned = self.end
+            return -1
+
+        return end_header_ind + len(RequestReader.TERMINATOR)
+
+    def has_header(self) -> bool:
+        """Returns whether a full header is buffered already, so the next request can be read without waiting"""
+        return self.find_terminator() != -1
+
+    def read_header(self, idle_timeout: float = None, header_timeout: float = None, max_size: int = None) -> bytes:
+        """Receive data until a full header is buffered and consume it
+
+        Afterwards the timeout of the socket is header_timeout, so every receive of the body and every send of the
+        response has to make progress within that time.
+        If more than max_size bytes are buffered without the end of a header, all of them are consumed and returned
+        instead, so the caller can reject the request without buffering an unbounded header.
+
+        Parameters
+        ----------
+        idle_timeout: float
+            The seconds to wait for the first byte of the header if nothing is buffered, None to wait forever
+        header_timeout: float
+            The seconds to wait for the rest of the header once its first byte is received, None to wait forever
+        max_size: int
+            The maximum length of the header in bytes, None for no limit
+
+        Returns
+        -------
+        bytes
+            Returns the header, including the terminating empty line, or more than max_size bytes without it
+
+        Raises
+        ------
+        TimeoutError
+            If the client did not send the header in time
+        ConnectionError
+            If the client closed the connection
+        """
+        end_header_ind = self.find_terminator()
+
+        if end_header_ind == -1 and self.buffered() == 0:
+            self.set_timeout(idle_timeout)
+            self.fill()
+            end_header_ind = self.find_terminator()
+
+        self.received_at = time.perf_counter()
+        deadline = None if header_timeout is None else time.monotonic() + header_timeout
+
+        while end_header_ind == -1:
+            if max_size is not None and self.buffered() > max_size:
+                end_header_ind = self.end
+                break
+
+            if deadline is not None:
+                # a client sending its header byte by byte must not reset the timeout with every byte
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    raise TimeoutError("client did not send the header in time")
+
+                self.set_timeout(remaining)
+
+            self.fill()
+            end_header_ind = self.find_terminator()
+
+        self.set_timeout(header_timeout)
+        raw_header = bytes(self.buffer[self.start:end_header_ind])
+        self.start = self.scanned = end_header_ind
+        return raw_header
+
+    def set_timeout(self, timeout: float):
+        """Set the timeout of the socket, skipping the system calls if it is set already"""
+        if self.conn_socket.gettimeout() != timeout:
+            self.conn_socket.settimeout(timeout)
+
+    def read_into(self, destination, size: int):
+        """Consume exactly size bytes and write them to the given binary file object as they arrive
+
+        The bytes are written straight from the buffer, so memory use does not depend on size.
+
+        Parameters
+        ----------
+        destination
+            A binary file object with a write method
+        size: int
+            The number of bytes to consume
+        """
+        while size > 0:
+            if self.start == self.end:
+                self.fill()
+
+            end = min(self.start + size, self.end)
+
+            with memoryview(self.buffer) as view:
+                destination.write(view[self.start:end])
+
+            size -= end - self.start
+            self.start = end
+            self.scanned = max(self.scanned, end)
+
+    def skip(self, size: int):
+        """Consume exactly size bytes without keeping them
+
+        Parameters
+        ----------
+        size: int
+            The number of bytes to discard
+        """
+        while size > 0:
+            if self.start == self.end:
+                self.fill()
+
+            end = min(self.start + size, self.end)
+            size -= end - self.start
+            self.start = end
+            self.scanned = max(self.scanned, end)
 
+
+class Request:
     """
+    A class where an object holds a request header, parsed in a single pass
 
-    PORT: int = 5055
-    HEADER: int = 1
-    FORMAT: str = 'latin-1'
-    REQUESTS = ["GET", "HEAD", "PUT", "POST"]
-    DISCONNECT_MESSAGE: str = "DISCONNECT"
-    INDEX_DATE_LAST_MOD: str = "18 Mar 2021 20:44:30 GMT"
-    SEA_DATE_LAST_MOD: str = "18 Mar 2021 20:44:30 GMT"
-    MONTHS: dict = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, "Aug": 8, "Sep": 9,
-                    "Oct": 10, "Nov": 11, "Dec": 12}
+    The header fields are kept in a dictionary by their lowercase names, so looking them up ignores the case of the
+    name like HTTP requires. Repeated fields are combined into one comma separated value.
+    A header that can not be parsed still results in an object, with the status code to answer it with as error.
 
-    ipv4: str
-    addr: tuple
-    server: socket.socket
+    Attributes
+    ----------
+    Request.MAX_FIELD_SIZE: int
+        a static integer specifying the maximum length of the request line and of every header field
+    Request.MAX_FIELDS: int
+        a static integer specifying the maximum number of header fields
+    Request.MAX_HEADER_SIZE: int
+        a static integer specifying the maximum length of the whole header in bytes
+    method: str
+        the method of the request line, for example GET, or an empty string
+    target: str
+        the request target of the request line, for example /index.html, or an empty string
+    version: str
+        the HTTP version of the request line, for example HTTP/1.1, or an empty string
+    headers: dict
+        a dictionary mapping the lowercase name of every header field to its value without surrounding whitespace
+    error: int
+        400 if the header is malformed, 431 if it exceeds the limits, None otherwise
+    """
+
+    __slots__ = ("method", "target", "version", "headers", "error")
+
+    MAX_FIELD_SIZE: int = 8 * 1024
+    MAX_FIELDS: int = 100
+    MAX_HEADER_SIZE: int = 64 * 1024
+
+    method: str
+    target: str
+    version: str
+    headers: dict
+    error: int
+
+    def __init__(self, method: str = "", target: str = "", version: str = "", headers: dict = None,
+                 error: int = None):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers if headers is not None else {}
+        self.error = error
+
+    @staticmethod
+    def parse(request_header: str) -> "Request":
+        """Parse a request header
+
+        Parameters
+        ----------
+        request_header: str
+            The header as received from the client, including the terminating empty line
+
+        Returns
+        -------
+        Request
+            Returns the parsed request, with error set if the header is malformed or too large
+        """
+        if len(request_header) > Request.MAX_HEADER_SIZE:
+            return Request(error=431)
+
+        lines = request_header.split("\r\n")
+
+        if len(lines) - 3 > Request.MAX_FIELDS or len(lines[0]) > Request.MAX_FIELD_SIZE:
+            return Request(error=431)
+
+        request_line = lines[0].split()
+
+        if len(request_line) != 3:
+            return Request(error=400)
+
+        headers = {}
+
+        # the header ends with an empty line, which splits into two empty strings, the method of a rejected header is
+        # kept, the response to HEAD never has a body
+        for line in itertools.islice(lines, 1, len(lines) - 2):
+            if len(line) > Request.MAX_FIELD_SIZE:
+                return Request(request_line[0], error=431)
+
+            name, colon, value = line.partition(":")
+
+            # whitespace between the name and the colon is not allowed
+            if not colon or not name or name[-1] in " \t":
+                return Request(request_line[0], error=400)
+
+            name = name.lower()
+            value = value.strip()
+
+            if name in headers:
+                headers[name] += ", " + value
+            else:
+                headers[name] = value
+
+        return Request(request_line[0], request_line[1], request_line[2], headers)
+
+    def get(self, name: str, default: str = None) -> str:
+        """Returns the value of the header field with the given name, ignoring the case of the name
+
+        Parameters
+        ----------
+        name: str
+            The name of the header field, without colon
+        default: str
+            The value to return if the request does not have the header field
+
+        Returns
+        -------
+        str
+            Returns the value of the header field without surrounding whitespace, or default
+        """
+        return self.headers.get(name.lower(), default)
+
+
+class AppendBatch:
+    """
+    A class where an object collects the appends to one file that are written together
+
+    Attributes
+    ----------
+    sources: list
+        a list of binary file objects, positioned at the start of the data to append, in the order they arrived
+    done: bool
+        True once the batch has been written
+    error: BaseException
+        the exception raised while writing the batch, or None
+    """
+
+    sources: list
+    done: bool
+    error: BaseException
 
     def __init__(self):
-        print("[SETUP] server is starting...")
-        # AF_INET says we work with IPv4 addresses
-        # SOCK_STREAM says data will be streamed through the socket
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sources = []
+        self.done = False
+        self.error = None
 
-    def connect(self):
-        """Bind the server to this machine's IPv4 address and start listening for connections.
 
-        This is the only function that should be called.
-        After connecting, a handler will be called to ask and handle http requests.
+class FileWriter:
+    """
+    A class where an object coordinates the writes of all clients to the files of the server
+
+    Every path has its own lock, so a file is only written by one client at a time and a file being replaced is never
+    appended to at the same time. Appends use group commit: while one client writes a batch and waits for it to reach
+    the disk, the appends of other clients to the same file are collected in the next batch, which the first of them
+    writes with a single write and a single sync once the lock is free again.
+    The durability mode decides whether written data is synced to the disk before the request is answered.
+    The object is shared by all clients and safe to use from several threads.
+
+    Attributes
+    ----------
+    FileWriter.DURABILITY_MODES: tuple
+        a static tuple with the durability modes: "none" leaves writing back to the operating system, "fdatasync"
+        syncs the data of a file and "fsync" syncs the data and metadata of a file and its directory
+    FileWriter.SPOOL_SIZE: int
+        a static integer specifying the size in bytes up to which the body of a POST request is kept in memory
+    durability: str
+        the durability mode, one of FileWriter.DURABILITY_MODES
+    locks: dict
+        a dictionary mapping the path of every file being written to a list of its lock and the number of users
+    batches: dict
+        a dictionary mapping the path of every file with waiting appends to the AppendBatch collecting them
+    lock: threading.Lock
+        the lock protecting locks and batches
+    """
+
+    DURABILITY_MODES: tuple = ("none", "fdatasync", "fsync")
+    SPOOL_SIZE: int = 256 * 1024
+
+    durability: str
+    locks: dict
+    batches: dict
+    lock: threading.Lock
+
+    def __init__(self, durability: str = "none"):
+        if durability not in FileWriter.DURABILITY_MODES:
+            raise ValueError("unknown durability mode: " + durability)
+
+        self.durability = durability
+        self.locks = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def locked(self, path: str):
+        """Hold the lock of the given path, created for as long as someone uses it
+
+        Parameters
+        ----------
+        path: str
+            The path of the file to lock
         """
-        self.ipv4 = socket.gethostbyname(socket.gethostname())
-        self.addr = (self.ipv4, HttpServer.PORT)
-        self.server.bind(self.addr)
-        print("[SETUP] server bound to IPv4 address", self.ipv4, "on port", HttpServer.PORT)
-        self.server.listen()
-        print("[SETUP] server listening for connections")
+        with self.lock:
+            entry = self.locks.get(path)
 
-    def __manage_client_thread(self, conn_socket: socket.socket, address: tuple):
-        """Manages a single client.
+            if entry is None:
+                entry = self.locks[path] = [threading.Lock(), 0]
 
-        Checks the received messages of the given client for HTTP commands and acts accordingly
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+
+                if entry[1] == 0:
+                    del self.locks[path]
+
+    def append(self, path: str, source):
+        """Append the data of a file object to the file at the given path, together with the appends of others
+
+        Returns once the data is written, and synced according to the durability mode.
+
+        Parameters
+        ----------
+        path: str
+            The path of the file to append to
+        source
+            A binary file object positioned at the start of the data to append
+        """
+        with self.lock:
+            batch = self.batches.get(path)
+
+            if batch is None:
+                batch = self.batches[path] = AppendBatch()
+
+            batch.sources.append(source)
+
+        with self.locked(path):
+            if not batch.done:
+                # the first client to get the lock writes the appends of everyone who joined the batch so far
+                with self.lock:
+                    if self.batches.get(path) is batch:
+                        del self.batches[path]
+
+                try:
+                    with open(path, "ab") as f:
+                        for batch_source in batch.sources:
+                            shutil.copyfileobj(batch_source, f)
+
+                        f.flush()
+                        self.sync(f.fileno())
+                except BaseException as e:
+                    batch.error = e
+                    raise
+                finally:
+                    batch.done = True
+
+        if batch.error is not None:
+            raise OSError("appending to " + path + " failed") from batch.error
+
+    def replace(self, temp_path: str, path: str, f):
+        """Close a temporary file and atomically move it to the given path
+
+        The temporary file gets the permissions of the file it replaces, or 0o644 for a new file.
+
+        Parameters
+        ----------
+        temp_path: str
+            The path of the temporary file, in the same directory as path
+        path: str
+            The path of the file to replace
+        f
+            The binary file object of the temporary file
+        """
+        f.flush()
+        self.sync(f.fileno())
+        f.close()
+
+        with self.locked(path):
+            try:
+                mode = os.stat(path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, path)
+
+            if self.durability == "fsync":
+                # the rename itself is only durable once the directory is synced
+                directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+
+    def sync(self, fd: int):
+        """Sync the file with the given file descriptor to the disk, according to the durability mode"""
+        if self.durability == "fsync":
+            os.fsync(fd)
+        elif self.durability == "fdatasync":
+            os.fdatasync(fd)
+
+
+class UploadFile:
+    """
+    A class where an object represents a file that is being written with the body of a PUT or POST request
+
+    The body is never written to the file while it is received, so a slow client does not hold any lock and a
+    client that disconnects halfway leaves nothing behind. When appending, the body is spooled in memory, or in a
+    temporary file once it grows large, and appended by the FileWriter when the upload is committed. Otherwise it is
+    written to a temporary file in the same directory, which only replaces the file when the upload is committed.
+    Temporary files are never indexed or served, so a partial upload, or one left behind by a crash, stays hidden.
+
+    Attributes
+    ----------
+    UploadFile.PREFIX: str
+        a static string starting the name of every temporary file
+    path: str
+        the path of the file to write
+    append: bool
+        True if the data is appended to the file, False if the data replaces the file
+    writer: FileWriter
+        the writer coordinating the writes to the file with those of other clients
+    temp_path: str
+        the path of the temporary file, or None when appending
+    f
+        the binary file object the data is written to
+    """
+
+    PREFIX: str = ".upload-"
+
+    path: str
+    append: bool
+    writer: FileWriter
+    temp_path: str
+
+    def __init__(self, path: str, append: bool, writer: FileWriter):
+        self.path = path
+        self.append = append
+        self.writer = writer
+
+        if append:
+            self.temp_path = None
+            self.f = tempfile.SpooledTemporaryFile(max_size=FileWriter.SPOOL_SIZE, dir=os.path.dirname(path) or ".")
+        else:
+            fd, self.temp_path = tempfile.mkstemp(prefix=UploadFile.PREFIX, dir=os.path.dirname(path) or ".")
+            self.f = os.fdopen(fd, "wb")
+
+    def write(self, data) -> int:
+        """Write the given bytes-like object to the file
+
+        Parameters
+        ----------
+        data
+            A bytes-like object to write
+
+        Returns
+        -------
+        int
+            Returns the number of bytes written
+        """
+        return self.f.write(data)
+
+    def commit(self):
+        """Append the spooled data to the file, or atomically move the temporary file to its final path"""
+        try:
+            if self.append:
+                self.f.seek(0)
+                self.writer.append(self.path, self.f)
+            else:
+                self.writer.replace(self.temp_path, self.path, self.f)
+                self.temp_path = None
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Close the file and throw away the temporary file, if any"""
+        self.f.close()
+
+        if self.temp_path is not None:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+
+class HttpDate:
+    """
+    A class providing the current date in the format of the HTTP Date header
+
+    Formatting a date is only done once per second, every other call returns the cached result. The current second
+    and its formatted date are kept in one tuple that is replaced as a whole, so threads and coroutines always see a
+    consistent pair without locking.
+
+    Attributes
+    ----------
+    HttpDate.WEEKDAYS: tuple
+        a static tuple with the abbreviated names of the days of the week, starting with Monday
+    HttpDate.MONTHS: tuple
+        a static tuple with the abbreviated names of the months, starting with January
+    HttpDate.cache: tuple
+        a static tuple with the second since the epoch, its date as a string and its date as bytes
+    """
+
+    WEEKDAYS: tuple = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+    MONTHS: tuple = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+    cache: tuple = (-1, "", b'')
+
+    @staticmethod
+    def format(seconds: int) -> str:
+        """Returns the given time in the format of the HTTP Date header
+
+        The names of days and months are always English, independent of the locale.
+
+        Parameters
+        ----------
+        seconds: int
+            The number of seconds since the epoch
+
+        Returns
+        -------
+        str
+            Returns the date, for example: Thu, 18 Mar 2021 20:44:30 GMT
+        """
+        t = time.gmtime(seconds)
+        return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (HttpDate.WEEKDAYS[t.tm_wday], t.tm_mday,
+                                                         HttpDate.MONTHS[t.tm_mon - 1], t.tm_year, t.tm_hour,
+                                                         t.tm_min, t.tm_sec)
+
+    @staticmethod
+    def parse(date_and_time: str) -> int:
+        """Returns the number of seconds since the epoch of the given date
+
+        Parameters
+        ----------
+        date_and_time: str
+            A date in one of the formats of HTTP, for example: Thu, 18 Mar 2021 20:44:30 GMT
+
+        Returns
+        -------
+        int
+            Returns the number of seconds since the epoch, or None if the date can not be parsed
+        """
+        parsed = email.utils.parsedate_tz(date_and_time.strip())
+
+        if parsed is None:
+            return None
+
+        return email.utils.mktime_tz(parsed)
+
+    @staticmethod
+    def __current() -> tuple:
+        """Returns the cache, after updating it if the second changed"""
+        cache = HttpDate.cache
+        seconds = int(time.time())
+
+        if cache[0] != seconds:
+            date = HttpDate.format(seconds)
+            cache = (seconds, date, date.encode(HttpServer.FORMAT))
+            HttpDate.cache = cache
+
+        return cache
+
+    @staticmethod
+    def now() -> str:
+        """Returns the current date in the format of the HTTP Date header"""
+        return HttpDate.__current()[1]
+
+    @staticmethod
+    def now_bytes() -> bytes:
+        """Returns the current date in the format of the HTTP Date header, encoded as bytes"""
+        return HttpDate.__current()[2]
+
+
+class FileInfo:
+    """
+    A class where an object holds the metadata of a single file in a DocumentIndex
+
+    Attributes
+    ----------
+    size: int
+        the size of the file in bytes
+    mtime_ns: int
+        the last modification time of the file in nanoseconds
+    content_type: str
+        the Content-Type header of the file
+    etag: str
+        the entity tag of the file, including quotes
+    """
+
+    __slots__ = ("size", "mtime_ns", "content_type", "etag")
+
+    size: int
+    mtime_ns: int
+    content_type: str
+    etag: str
+
+    def __init__(self, size: int, mtime_ns: int, content_type: str, etag: str):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_type = content_type
+        self.etag = etag
+
+
+class DocumentIndex:
+    """
+    A class where an object keeps the metadata of every regular file below a directory in memory
+
+    The directory is scanned once when the object is created. Afterwards a background thread keeps the index
+    current: on Linux it follows inotify events of every directory, elsewhere, or when inotify is not available, it
+    scans the directory again every POLL_INTERVAL seconds, until close is called. Directories that can not be
+    watched, for example because the inotify watches of the user are used up, are kept current by scanning the
+    directory again every POLL_INTERVAL seconds as well, while the watches are retried. Changes made by the server
+    itself are applied right away with update, so they never wait for the background thread.
+    The object is shared by all clients. Single entries are replaced atomically and a full scan replaces the whole
+    dictionary at once, so lookups need no lock.
+
+    Attributes
+    ----------
+    DocumentIndex.POLL_INTERVAL: float
+        a static float specifying the seconds between two scans when inotify is not available
+    DocumentIndex.EVENTS: int
+        a static integer with the inotify events that are watched in every directory
+    DocumentIndex.IN_Q_OVERFLOW: int
+        a static integer with the inotify event reporting that events were lost
+    DocumentIndex.IN_IGNORED: int
+        a static integer with the inotify event reporting that a watch was removed
+    DocumentIndex.IN_ISDIR: int
+        a static integer with the inotify flag marking events about a directory
+    root: str
+        the directory whose files are indexed
+    entries: dict
+        a dictionary mapping the path of every regular file, relative to the root and separated by "/", to its
+        FileInfo
+    watches: dict
+        a dictionary mapping every inotify watch descriptor to the directory it watches, relative to the root
+    add_watch
+        a function adding an inotify watch for a path and an event mask, set once inotify is available
+    changed: set
+        a set with the paths updated while a full scan runs, applied again after the scan, or None between scans
+    unwatched: set
+        a set with the directories, relative to the root, whose inotify watch could not be added
+    stopped: threading.Event
+        the event set by close to end the background thread
+    wakeup: tuple
+        the read and write end of a pipe interrupting the wait for inotify events, or None when polling
+    thread: threading.Thread
+        the background thread keeping the index current
+    """
+
+    POLL_INTERVAL: float = 1.0
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENTS: int = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+    IN_Q_OVERFLOW: int = 0x4000
+    IN_IGNORED: int = 0x8000
+    IN_ISDIR: int = 0x40000000
+
+    root: str
+    entries: dict
+    watches: dict
+    changed: set
+    unwatched: set
+    stopped: threading.Event
+    wakeup: tuple
+    thread: threading.Thread
+
+    def __init__(self, root: str = "."):
+        self.root = root
+        self.watches = {}
+        self.add_watch = None
+        self.changed = None
+        self.unwatched = set()
+        self.stopped = threading.Event()
+        self.wakeup = None
+        self.entries = self.scan()
+        fd = self.open_inotify()
+
+        if fd is None:
+            target = self.__poll
+        else:
+            self.wakeup = os.pipe()
+            target = functools.partial(self.__follow, fd)
+
+        self.thread = threading.Thread(target=target, name="document index", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stop the background thread and release the inotify instance, the index is no longer kept current"""
+        if self.stopped.is_set():
+            return
+
+        self.stopped.set()
+
+        if self.wakeup is not None:
+            os.write(self.wakeup[1], b"\0")
+
+        self.thread.join()
+
+    def get(self, path: str) -> FileInfo:
+        """Returns the metadata of the regular file at the given path
+
+        Parameters
+        ----------
+        path: str
+            The path of the file, relative to the root
+
+        Returns
+        -------
+        FileInfo
+            Returns the metadata, or None if there is no regular file at the path, or the path leads out of the root
+        """
+        info = self.entries.get(path)
+
+        if info is None and path:
+            # paths like "a/../b" or "./b" name an indexed file as well
+            normalized = posixpath.normpath(path)
+
+            if normalized != path:
+                info = self.entries.get(normalized)
+
+        return info
+
+    def update(self, path: str):
+        """Read the metadata of the file at the given path again, adding or removing it as needed
+
+        Parameters
+        ----------
+        path: str
+            The path of the file, relative to the root
+        """
+        path = posixpath.normpath(path)
+        changed = self.changed
+
+        if changed is not None:
+            changed.add(path)
+
+        info = DocumentIndex.read(os.path.join(self.root, path), path)
+
+        if info is None:
+            self.entries.pop(path, None)
+        else:
+            self.entries[path] = info
+
+    @staticmethod
+    def read(full_path: str, path: str) -> FileInfo:
+        """Returns the metadata of the regular file at the given path, or None if there is none or it is hidden"""
+        if DocumentIndex.is_hidden(path):
+            return None
+
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        return FileInfo(st.st_size, st.st_mtime_ns, HttpServer.get_content_type("/" + path),
+                        HttpServer.create_etag(st.st_size, st.st_mtime_ns))
+
+    @staticmethod
+    def is_hidden(path: str) -> bool:
+        """Returns True if the file at the given path is a temporary file of an upload, which is never served"""
+        return posixpath.basename(path).startswith(UploadFile.PREFIX)
+
+    def rescan(self):
+        """Scan the whole root again and replace the index
+
+        Paths updated while the scan runs may be missing from it, so they are updated again afterwards.
+        """
+        changed = self.changed = set()
+        self.entries = self.scan()
+        self.changed = None
+
+        for path in list(changed):
+            self.update(path)
+
+    def scan(self, directory: str = "") -> dict:
+        """Returns the metadata of all regular files below the given directory
+
+        Parameters
+        ----------
+        directory: str
+            The directory to scan, relative to the root, an empty string for the root itself
+
+        Returns
+        -------
+        dict
+            Returns a dictionary mapping the path of every file, relative to the root, to its FileInfo
+        """
+        entries = {}
+        directories = [directory]
+
+        while directories:
+            current = directories.pop()
+
+            try:
+                with os.scandir(os.path.join(self.root, current)) as it:
+                    for dir_entry in it:
+                        path = posixpath.join(current, dir_entry.name)
+
+                        try:
+                            if dir_entry.is_dir():
+                                directories.append(path)
+                            elif dir_entry.is_file() and not DocumentIndex.is_hidden(dir_entry.name):
+                                st = dir_entry.stat()
+                                entries[path] = FileInfo(st.st_size, st.st_mtime_ns,
+                                                         HttpServer.get_content_type("/" + path),
+                                                         HttpServer.create_etag(st.st_size, st.st_mtime_ns))
+                        except OSError:
+                            # the entry was removed while scanning
+                            continue
+            except OSError:
+                continue
+
+        return entries
+
+    def open_inotify(self):
+        """Create an inotify instance watching every directory below the root
+
+        Returns
+        -------
+        int
+            Returns the file descriptor of the inotify instance, or None if inotify is not available
+        """
+        if not sys.platform.startswith("linux"):
+            return None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+
+        if fd < 0:
+            return None
+
+        self.add_watch = functools.partial(libc.inotify_add_watch, fd)
+
+        for directory, _, _ in os.walk(self.root):
+            self.watch(posixpath.relpath(directory, self.root) if directory != self.root else "")
+
+        return fd
+
+    def watch(self, directory: str):
+        """Watch the given directory, relative to the root, with the inotify instance"""
+        wd = self.add_watch(os.fsencode(os.path.join(self.root, directory)), DocumentIndex.EVENTS)
+
+        if wd >= 0:
+            self.watches[wd] = directory
+            self.unwatched.discard(directory)
+            return
+
+        error = ctypes.get_errno()
+
+        if error == errno.ENOENT:
+            # a directory that was removed in the meantime does not have to be watched anymore
+            self.unwatched.discard(directory)
+        elif directory not in self.unwatched:
+            ServerLog.logger.warning("can not watch %s for changes, it is scanned instead: %s",
+                                     directory or self.root, os.strerror(error))
+            self.unwatched.add(directory)
+
+    def __follow(self, fd: int):
+        """Apply the inotify events read from the given file descriptor to the index, until closed"""
+        try:
+            self.__read_events(fd)
+        finally:
+            os.close(fd)
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+
+    def __read_events(self, fd: int):
+        """Read inotify events from the given file descriptor and apply them, until close is called"""
+        header = struct.Struct("iIII")
+        next_scan = time.monotonic() + DocumentIndex.POLL_INTERVAL
+
+        while True:
+            timeout = None
+
+            if self.unwatched:
+                timeout = max(next_scan - time.monotonic(), 0.0)
+
+            readable, _, _ = select.select([fd, self.wakeup[0]], [], [], timeout)
+
+            if self.stopped.is_set():
+                return
+
+            if self.unwatched and time.monotonic() >= next_scan:
+                # the watches are retried, the directories still not watched only stay current by scanning
+                for directory in list(self.unwatched):
+                    self.watch(directory)
+
+                self.rescan()
+                next_scan = time.monotonic() + DocumentIndex.POLL_INTERVAL
+
+            if fd not in readable:
+                continue
+
+            try:
+                data = os.read(fd, 64 * 1024)
+            except InterruptedError:
+                continue
+
+            offset = 0
+
+            while offset < len(data):
+                wd, mask, _, length = header.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + header.size:offset + header.size + length].rstrip(b"\0"))
+                offset += header.size + length
+
+                if mask & DocumentIndex.IN_Q_OVERFLOW:
+                    ServerLog.logger.warning("inotify events were lost, the document root is scanned again")
+                    self.rescan()
+                    continue
+
+                directory = self.watches.get(wd)
+
+                if mask & DocumentIndex.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                if directory is None or not name:
+                    continue
+
+                path = posixpath.join(directory, name)
+
+                if not mask & DocumentIndex.IN_ISDIR:
+                    self.update(path)
+                elif os.path.isdir(os.path.join(self.root, path)):
+                    # a directory was created or moved in, with its files
+                    for subdirectory, _, _ in os.walk(os.path.join(self.root, path)):
+                        self.watch(posixpath.relpath(subdirectory, self.root))
+
+                    self.entries.update(self.scan(path))
+                else:
+                    # a directory was removed or moved out, with its files
+                    prefix = path + "/"
+
+                    for indexed in [indexed for indexed in self.entries if indexed.startswith(prefix)]:
+                        self.entries.pop(indexed, None)
+
+    def __poll(self):
+        """Scan the root every POLL_INTERVAL seconds and replace the index, until closed"""
+        while not self.stopped.wait(DocumentIndex.POLL_INTERVAL):
+            self.rescan()
+
+
+class CacheEntry:
+    """
+    A class where an object represents a file kept in memory by a FileCache, or a compressed variant of one
+
+    Attributes
+    ----------
+    body: bytes
+        the contents of the file
+    headers: bytes
+        the Content-Length, Content-Type, ETag, Last-Modified and Accept-Ranges headers of the file, including the
+        terminating empty line, together with the Content-Encoding and Vary headers if they apply
+    validators: bytes
+        the ETag and Last-Modified headers of the file, each preceded by CRLF
+    etag: str
+        the entity tag of the file, including quotes
+    mtime_ns: int
+        the last modification time of the file in nanoseconds when it was read
+    size: int
+        the size of the file in bytes when it was read
+    checked: float
+        the monotonic time the file was last compared with the file on disk
+    variants: dict
+        a dictionary mapping content codings to the compressed variant of the file, or to None if compressing
+        does not make the file smaller
+    footprint: int
+        the number of bytes of the body and the bodies of all variants
+    """
+
+    body: bytes
+    headers: bytes
+    validators: bytes
+    etag: str
+    mtime_ns: int
+    size: int
+    checked: float
+    variants: dict
+    footprint: int
+
+    def __init__(self, body: bytes, headers: bytes, validators: bytes, etag: str, mtime_ns: int, size: int,
+                 checked: float):
+        self.body = body
+        self.headers = headers
+        self.validators = validators
+        self.etag = etag
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked = checked
+        self.variants = {}
+        self.footprint = len(body)
+
+
+class FileCache:
+    """
+    A class where an object keeps small files in memory, ready to be sent
+
+    The total size of the cached files is bounded, the least recently used file is evicted first. A cached file is
+    compared with the file on disk at most once every REVALIDATE_INTERVAL seconds, so a hot file is served without
+    any system call in between, and is read again when its modification time or size changed.
+    The object is shared by all clients and safe to use from several threads.
+
+    Attributes
+    ----------
+    FileCache.REVALIDATE_INTERVAL: float
+        a static float specifying the seconds a cached file is used before it is compared with the file on disk
+    max_size: int
+        an integer specifying the maximum number of bytes of file contents in the cache
+    max_file_size: int
+        an integer specifying the size in bytes of the largest file that is cached
+    size: int
+        an integer specifying the number of bytes of file contents currently in the cache
+    entries: collections.OrderedDict
+        a dictionary mapping the path of every cached file to its CacheEntry, least recently used first
+    hits: int
+        an integer counting the lookups answered from the cache
+    misses: int
+        an integer counting the lookups that had to read the file into the cache, lookups of files that are missing
+        or too large to cache are not counted
+    lock: threading.Lock
+        the lock protecting the entries and counters
+    """
+
+    REVALIDATE_INTERVAL: float = 1.0
+
+    max_size: int
+    max_file_size: int
+    size: int
+    entries: collections.OrderedDict
+    hits: int
+    misses: int
+    lock: threading.Lock
+
+    def __init__(self, max_size: int, max_file_size: int):
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path: str, info: FileInfo = None) -> CacheEntry:
+        """Returns the cached contents of the file at the given path, reading the file if needed
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        info: FileInfo
+            The current metadata of the file from a DocumentIndex, or None. A cached file that differs from it is
+            read again right away, otherwise it is still compared with the file on disk once per
+            REVALIDATE_INTERVAL, since the index may lag behind the file
+
+        Returns
+        -------
+        CacheEntry
+            Returns the cached file, or None if the path is not a regular file or the file is too large to cache
+        """
+        if info is not None and info.size > self.max_file_size:
+            # the file is not opened at all, a smaller version of it may still be cached
+            if path in self.entries:
+                self.invalidate(path)
+
+            return None
+
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(path)
+
+            if entry is not None and info is not None and (info.mtime_ns != entry.mtime_ns
+                                                           or info.size != entry.size):
+                # the index saw the file change
+                entry = None
+
+            if entry is not None and now - entry.checked < FileCache.REVALIDATE_INTERVAL:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry
+
+        if entry is not None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+
+            if st is not None and st.st_mtime_ns == entry.mtime_ns and st.st_size == entry.size:
+                with self.lock:
+                    entry.checked = now
+                    self.hits += 1
+
+                return entry
+
+        ServerMetrics.mark("lookup")
+        entry = FileCache.read(path, self.max_file_size, now)
+        ServerMetrics.mark("read")
+
+        with self.lock:
+            self.__remove(path)
+
+            if entry is not None:
+                self.misses += 1
+                self.entries[path] = entry
+                self.size += entry.footprint
+                self.__evict()
+
+        return entry
+
+    def get_variant(self, path: str, entry: CacheEntry, encoding: str) -> CacheEntry:
+        """Returns the variant of a cached file compressed with the given content coding
+
+        The variant is created the first time it is asked for and kept with the cached file, so it is dropped
+        together with the file when the file changes on disk or is evicted.
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        entry: CacheEntry
+            The cached file, as returned by get
+        encoding: str
+            Either "gzip" or "deflate"
+
+        Returns
+        -------
+        CacheEntry
+            Returns the compressed variant, or None if compressing does not make the file smaller
+        """
+        with self.lock:
+            if encoding in entry.variants:
+                return entry.variants[encoding]
+
+        variant = FileCache.compress(path, entry, encoding)
+
+        with self.lock:
+            if encoding not in entry.variants:
+                entry.variants[encoding] = variant
+
+                if variant is not None:
+                    entry.footprint += variant.size
+
+                    if self.entries.get(path) is entry:
+                        self.size += variant.size
+                        self.__evict()
+
+        return variant
+
+    def __evict(self):
+        """Remove the least recently used files until the cache is within its size, the lock must be held"""
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.footprint
+
+    def invalidate(self, path: str):
+        """Remove the file at the given path from the cache, for example because it was just written
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        """
+        with self.lock:
+            self.__remove(path)
+
+    def __remove(self, path: str):
+        """Remove the file at the given path from the cache, the lock must be held"""
+        entry = self.entries.pop(path, None)
+
+        if entry is not None:
+            self.size -= entry.footprint
+
+    @staticmethod
+    def read(path: str, max_file_size: int, now: float) -> CacheEntry:
+        """Read the file at the given path into a new CacheEntry
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        max_file_size: int
+            The size in bytes of the largest file to read
+        now: float
+            The monotonic time to store as time of the last check
+
+        Returns
+        -------
+        CacheEntry
+            Returns the file, or None if the path is not a regular file or the file is larger than max_file_size
+        """
+        try:
+            f = open(path, mode='rb')
+        except OSError:
+            return None
+
+        with f:
+            st = os.fstat(f.fileno())
+
+            if not stat.S_ISREG(st.st_mode) or st.st_size > max_file_size:
+                return None
+
+            body = f.read(st.st_size)
+
+        content_data = HttpServer.get_content_data("/" + path, len(body))
+        validator_data = HttpServer.get_validator_data(len(body), st.st_mtime_ns)
+        headers = content_data + HttpServer.get_encoding_data("/" + path, None) + "\r\n" + validator_data \
+            + "\r\nAccept-Ranges: bytes\r\n\r\n"
+        validators = "\r\n" + validator_data + HttpServer.get_encoding_data("/" + path, None)
+        return CacheEntry(body, headers.encode(HttpServer.FORMAT), validators.encode(HttpServer.FORMAT),
+                          HttpServer.create_etag(len(body), st.st_mtime_ns), st.st_mtime_ns, len(body), now)
+
+    @staticmethod
+    def compress(path: str, entry: CacheEntry, encoding: str) -> CacheEntry:
+        """Create the variant of a cached file compressed with the given content coding
+
+        For gzip, a precompressed sibling file with the extension .gz is used instead when it is at least as new as
+        the file itself.
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        entry: CacheEntry
+            The cached file
+        encoding: str
+            Either "gzip" or "deflate"
+
+        Returns
+        -------
+        CacheEntry
+            Returns the compressed variant, or None if compressing does not make the file smaller
+        """
+        body = None
+
+        if encoding == "gzip":
+            f = HttpServer.open_precompressed(path, entry.mtime_ns)
+
+            if f is not None:
+                with f:
+                    body = f.read()
+            else:
+                body = gzip.compress(entry.body, mtime=0)
+        else:
+            body = zlib.compress(entry.body)
+
+        if len(body) >= entry.size:
+            return None
+
+        # a variant is a different representation, so it needs its own entity tag
+        etag = entry.etag[:-1] + "-" + encoding + '"'
+        validator_data = "ETag: " + etag + "\r\nLast-Modified: " + HttpDate.format(entry.mtime_ns // 1000000000)
+        headers = "Content-Length: " + str(len(body)) + "\r\n" + HttpServer.get_content_type("/" + path) \
+            + HttpServer.get_encoding_data("/" + path, encoding) + "\r\n" + validator_data + "\r\n\r\n"
+        validators = "\r\n" + validator_data + HttpServer.get_encoding_data("/" + path, None)
+        return CacheEntry(body, headers.encode(HttpServer.FORMAT), validators.encode(HttpServer.FORMAT), etag,
+                          entry.mtime_ns, len(body), entry.checked)
+
+
+class HttpResponse:
+    """
+    A class where an object represents a response to send to a client
+
+    Attributes
+    ----------
+    header: bytes
+        the status line and headers, including the terminating empty line
+    body: bytes
+        the part of the body held in memory, sent right after the header
+    parts: list
+        further bytes-like objects of the body, sent after body in order
+    file
+        a binary file object of which count bytes starting at offset are sent after the parts, or None
+    offset: int
+        the position in the file of the first byte to send
+    count: int
+        the number of bytes of the file to send
+    mapping: mmap.mmap
+        a memory-mapped file that parts are views of, or None
+    chunks
+        an iterable or asynchronous iterable of bytes sent after the header with the chunked transfer coding, or
+        None if the response has a Content-Length
+    size: int
+        the number of bytes of the body without chunks, recorded by measure when the response is sent, since
+        closing the response drops its parts
+    """
+
+    header: bytes
+    body: bytes
+    parts: list
+    offset: int
+    count: int
+    mapping: mmap.mmap
+    size: int
+
+    def __init__(self, header: bytes, body: bytes = b'', file=None, offset: int = 0, count: int = 0,
+                 parts: list = None, mapping: mmap.mmap = None, chunks=None):
+        self.header = header
+        self.body = body
+        self.parts = parts if parts is not None else []
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.mapping = mapping
+        self.chunks = chunks
+        self.size = 0
+
+    def drop_body(self):
+        """Close the body of the response and keep its header, including Content-Length, as an answer to HEAD"""
+        self.close()
+        self.body = b''
+        self.parts = []
+        self.count = 0
+
+    def measure(self):
+        """Record the size of the body, before it is sent and the response is closed"""
+        self.size = len(self.body) + self.count + sum(len(part) for part in self.parts)
+
+    def close(self):
+        """Close the file, memory-mapped file and generator of chunks of the response, if any"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        if self.chunks is not None:
+            # a generator that was not exhausted runs its cleanup now, asynchronous ones when they are collected
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+
+            self.chunks = None
+
+        if self.mapping is not None:
+            # the views on the mapping have to be released before it can be closed
+            for part in self.parts:
+                if isinstance(part, memoryview):
+                    part.release()
+
+            self.parts = []
+
+            try:
+                self.mapping.close()
+            except BufferError:
+                # a transport still holds views on the parts that were not sent, the mapping is unmapped once
+                # they are gone
+                pass
+
+            self.mapping = None
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    A queue handler that puts records on the queue as they are
+
+    The standard QueueHandler formats every record before queueing it, which would put the cost of formatting back
+    on the thread that logs. The arguments of the records logged by the server are plain strings and numbers, so
+    formatting them later on the thread of the listener is safe.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Returns the record unchanged, it is formatted by the handler of the listener"""
+        return record
+
+
+class ServerLog:
+    """
+    A class providing the logging of the server
+
+    Records are put on a queue and written by a background thread, so a request never waits for the output stream.
+    Access logs are written for one in every access_sample requests, in a compact line of key=value pairs, and can be
+    turned off completely by setting access_sample to 0.
+
+    Attributes
+    ----------
+    ServerLog.FORMAT: str
+        a static string with the format of a written line
+    ServerLog.logger: logging.Logger
+        a static logger for the messages of the server
+    ServerLog.access_sample: int
+        a static integer specifying that one in every access_sample requests is logged, 0 disables access logs
+    ServerLog.requests: itertools.count
+        a static counter of the requests that could be logged
+    ServerLog.listener: logging.handlers.QueueListener
+        a static listener writing the queued records, or None if logging is not configured
+    """
+
+    FORMAT: str = "%(asctime)s %(levelname)s %(message)s"
+
+    logger: logging.Logger = logging.getLogger("server")
+    access_sample: int = 1
+    requests: itertools.count = itertools.count()
+    listener: logging.handlers.QueueListener = None
+
+    @staticmethod
+    def configure(level: int = logging.INFO, access_sample: int = 1, stream=None):
+        """Send the records of the server through a queue to a background thread writing them to a stream
+
+        Parameters
+        ----------
+        level: int
+            The lowest level of the records to log
+        access_sample: int
+            Log one in every access_sample requests, 0 to disable access logs
+        stream
+            The text stream to write to, None for standard error
+        """
+        ServerLog.stop()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(ServerLog.FORMAT))
+        records = queue.SimpleQueue()
+        ServerLog.logger.handlers = [LogQueueHandler(records)]
+        ServerLog.logger.setLevel(level)
+        ServerLog.logger.propagate = False
+        ServerLog.access_sample = access_sample
+        ServerLog.listener = logging.handlers.QueueListener(records, handler)
+        ServerLog.listener.start()
+
+    @staticmethod
+    def stop():
+        """Write the queued records and stop the background thread"""
+        if ServerLog.listener is not None:
+            ServerLog.listener.stop()
+            ServerLog.listener = None
+
+    @staticmethod
+    def restart_after_fork():
+        """Start a new background thread in a forked process, the thread of the parent does not exist there"""
+        if ServerLog.listener is not None:
+            records = queue.SimpleQueue()
+            ServerLog.logger.handlers[0].queue = records
+            ServerLog.listener = logging.handlers.QueueListener(records, *ServerLog.listener.handlers)
+            ServerLog.listener.start()
+
+    @staticmethod
+    def access(address: tuple, command: str, file: str, response: HttpResponse, start: float):
+        """Log a request that has been answered, if it is part of the sample
+
+        Parameters
+        ----------
+        address: tuple
+            Tuple consisting of length two with respectively the IPv4 address and port of the client
+        command: str
+            The command of the request, or None if the request was not valid, logged as "-"
+        file: str
+            The requested file, or None if the request was not valid, logged as "-"
+        response: HttpResponse
+            The response sent to the client
+        start: float
+            The value of time.perf_counter() when the request header was received
+        """
+        sample = ServerLog.access_sample
+
+        if sample == 0 or next(ServerLog.requests) % sample != 0 or not ServerLog.logger.isEnabledFor(logging.INFO):
+            return
+
+        ServerLog.logger.info("access addr=%s method=%s path=%s status=%s bytes=%d ms=%.3f", address[0],
+                              command or "-", file or "-", response.header[9:12].decode(HttpServer.FORMAT),
+                              response.size,
+                              (time.perf_counter() - start) * 1000)
+
+
+os.register_at_fork(after_in_child=ServerLog.restart_after_fork)
+
+
+class RequestTimer:
+    """
+    A class where an object splits the time spent on a single request into stages
+
+    Every mark closes the stage that started at the previous mark, so a stage marked several times adds up.
+
+    Attributes
+    ----------
+    RequestTimer.STAGES: tuple
+        a static tuple with the stages in the order they happen: receiving the header, parsing it, checking the file,
+        reading it, receiving the body, building the response and sending it
+    stages: dict
+        a dictionary mapping every stage marked so far to its seconds
+    last: float
+        the value of time.perf_counter() at the previous mark
+    """
+
+    __slots__ = ("stages", "last")
+
+    STAGES: tuple = ("header", "parse", "lookup", "read", "body", "build", "send")
+
+    stages: dict
+    last: float
+
+    def __init__(self, start: float):
+        self.stages = {}
+        self.last = start
+
+    def mark(self, stage: str):
+        """Add the time since the previous mark to the given stage"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+class ThreadMetrics:
+    """
+    A class where an object holds the counters of a single thread
+
+    Only the owning thread writes to the object, so counting needs no lock. Readers add up the objects of all threads
+    and may see a count that is one request behind, which is fine for monitoring.
+
+    Attributes
+    ----------
+    requests: dict
+        a dictionary mapping a tuple of the method and status code to the number of answered requests
+    buckets: list
+        a list with the number of requests whose duration fell in each bucket of ServerMetrics.BUCKETS, the last one
+        counting the requests slower than every bound
+    duration_sum: float
+        the total duration in seconds of all requests
+    bytes_received: int
+        the number of bytes of request headers and bodies received
+    bytes_sent: int
+        the number of bytes of responses sent
+    connections_opened: int
+        the number of connections that started being managed
+    connections_closed: int
+        the number of connections that ended
+    stage_seconds: dict
+        a dictionary mapping a tuple of the route and stage to the seconds spent in the stage by timed requests
+    stage_requests: dict
+        a dictionary mapping every route to the number of timed requests
+    busy: int
+        1 while the thread is a worker managing a client, 0 otherwise
+    """
+
+    requests: dict
+    buckets: list
+    duration_sum: float
+    bytes_received: int
+    bytes_sent: int
+    connections_opened: int
+    connections_closed: int
+    stage_seconds: dict
+    stage_requests: dict
+    busy: int
+
+    def __init__(self):
+        self.requests = {}
+        self.buckets = [0] * (len(ServerMetrics.BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.stage_seconds = {}
+        self.stage_requests = {}
+        self.busy = 0
+
+
+class ServerMetrics:
+    """
+    A class providing the instrumentation of the server
+
+    Every thread counts in its own ThreadMetrics object, all objects are only added up when the metrics are exported
+    in the Prometheus text format. The counters are kept per process.
+
+    Attributes
+    ----------
+    ServerMetrics.BUCKETS: tuple
+        a static tuple with the upper bounds in seconds of the buckets of the request duration histogram
+    ServerMetrics.local: threading.local
+        a static object holding the ThreadMetrics of the current thread, and the RequestTimer of the request it is
+        handling if requests are timed by stage
+    ServerMetrics.threads: list
+        a static list with the ThreadMetrics of every thread that counted something
+    ServerMetrics.lock: threading.Lock
+        a static lock protecting the list of threads, only taken the first time a thread counts something
+    """
+
+    BUCKETS: tuple = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    local: threading.local = threading.local()
+    threads: list = []
+    lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def current() -> ThreadMetrics:
+        """Returns the counters of the current thread, created the first time they are needed"""
+        try:
+            return ServerMetrics.local.metrics
+        except AttributeError:
+            metrics = ThreadMetrics()
+
+            with ServerMetrics.lock:
+                ServerMetrics.threads.append(metrics)
+
+            ServerMetrics.local.metrics = metrics
+            return metrics
+
+    @staticmethod
+    def observe(command: str, response: HttpResponse, start: float, received: int):
+        """Count a request that has been answered
+
+        Parameters
+        ----------
+        command: str
+            The command of the request, or None if the request was not valid
+        response: HttpResponse
+            The response sent to the client
+        start: float
+            The value of time.perf_counter() when the request header was received
+        received: int
+            The number of bytes of the request header and body
+        """
+        duration = time.perf_counter() - start
+        metrics = ServerMetrics.current()
+        key = (command or "other", response.header[9:12])
+        metrics.requests[key] = metrics.requests.get(key, 0) + 1
+        metrics.buckets[bisect.bisect_left(ServerMetrics.BUCKETS, duration)] += 1
+        metrics.duration_sum += duration
+        metrics.bytes_received += received
+        metrics.bytes_sent += len(response.header) + response.size
+
+    @staticmethod
+    def start_timer(start: float):
+        """Start timing the stages of the request the current thread handles
+
+        Parameters
+        ----------
+        start: float
+            The value of time.perf_counter() when the first byte of the request was available
+        """
+        ServerMetrics.local.timer = RequestTimer(start)
+
+    @staticmethod
+    def mark(stage: str):
+        """End a stage of the request the current thread handles, if its stages are timed
+
+        Parameters
+        ----------
+        stage: str
+            One of RequestTimer.STAGES
+        """
+        timer = getattr(ServerMetrics.local, "timer", None)
+
+        if timer is not None:
+            timer.mark(stage)
+
+    @staticmethod
+    def finish_timer(file: str, response: HttpResponse):
+        """Count the stages of the request the current thread handled, if they are timed
+
+        The route is the requested file without its query. Requests for files that do not exist or that failed are
+        counted under the route "other", so the number of routes stays bounded.
+
+        Parameters
+        ----------
+        file: str
+            The requested file, or None if the request was not valid
+        response: HttpResponse
+            The response sent to the client
+        """
+        timer = getattr(ServerMetrics.local, "timer", None)
+
+        if timer is None:
+            return
+
+        ServerMetrics.local.timer = None
+        route = file.partition("?")[0] if file is not None and response.header[9:10] in b"123" else "other"
+        metrics = ServerMetrics.current()
+        metrics.stage_requests[route] = metrics.stage_requests.get(route, 0) + 1
+
+        for stage, seconds in timer.stages.items():
+            key = (route, stage)
+            metrics.stage_seconds[key] = metrics.stage_seconds.get(key, 0.0) + seconds
+
+    @staticmethod
+    def connection_opened():
+        """Count a connection that started being managed"""
+        ServerMetrics.current().connections_opened += 1
+
+    @staticmethod
+    def connection_closed():
+        """Count a connection that ended"""
+        ServerMetrics.current().connections_closed += 1
+
+    @staticmethod
+    def set_worker_busy(busy: bool):
+        """Mark the current worker thread as managing a client, or as waiting for one"""
+        ServerMetrics.current().busy = 1 if busy else 0
+
+    @staticmethod
+    def busy_workers() -> int:
+        """Returns the number of worker threads currently managing a client"""
+        with ServerMetrics.lock:
+            threads = list(ServerMetrics.threads)
+
+        return sum(metrics.busy for metrics in threads)
+
+    @staticmethod
+    def export(counters: list, gauges: list) -> str:
+        """Returns the counters of all threads together with the given metrics in the Prometheus text format
+
+        Parameters
+        ----------
+        counters: list
+            A list of tuples of the name, help text and current value of counters of the server
+        gauges: list
+            A list of tuples of the name, help text and current value of gauges of the server
+
+        Returns
+        -------
+        str
+            Returns the metrics, one sample per line
+        """
+        with ServerMetrics.lock:
+            threads = list(ServerMetrics.threads)
+
+        requests = {}
+        buckets = [0] * (len(ServerMetrics.BUCKETS) + 1)
+        duration_sum = 0.0
+        stage_seconds = {}
+        stage_requests = {}
+        bytes_received = bytes_sent = connections_opened = connections_closed = 0
+
+        for metrics in threads:
+            # copy first, the owning thread may add a key while it is iterated
+            for key, count in metrics.requests.copy().items():
+                requests[key] = requests.get(key, 0) + count
+
+            for i, count in enumerate(metrics.buckets):
+                buckets[i] += count
+
+            for key, seconds in metrics.stage_seconds.copy().items():
+                stage_seconds[key] = stage_seconds.get(key, 0.0) + seconds
+
+            for route, count in metrics.stage_requests.copy().items():
+                stage_requests[route] = stage_requests.get(route, 0) + count
+
+            duration_sum += metrics.duration_sum
+            bytes_received += metrics.bytes_received
+            bytes_sent += metrics.bytes_sent
+            connections_opened += metrics.connections_opened
+            connections_closed += metrics.connections_closed
+
+        lines = ["# HELP http_requests_total Requests answered, by method and status code",
+                 "# TYPE http_requests_total counter"]
+
+        for (method, status), count in sorted(requests.items()):
+            lines.append('http_requests_total{method="%s",status="%s"} %d'
+                         % (method, status.decode(HttpServer.FORMAT), count))
+
+        lines += ["# HELP http_request_duration_seconds Time from receiving the request header to sending the response",
+                  "# TYPE http_request_duration_seconds histogram"]
+        cumulative = 0
+
+        for bound, count in zip(ServerMetrics.BUCKETS, buckets):
+            cumulative += count
+            lines.append('http_request_duration_seconds_bucket{le="%s"} %d' % (bound, cumulative))
+
+        cumulative += buckets[-1]
+        lines += ['http_request_duration_seconds_bucket{le="+Inf"} %d' % cumulative,
+                  "http_request_duration_seconds_sum %f" % duration_sum,
+                  "http_request_duration_seconds_count %d" % cumulative]
+
+        if stage_requests:
+            lines += ["# HELP http_request_stage_seconds_total Time spent in every stage of timed requests, by route",
+                      "# TYPE http_request_stage_seconds_total counter"]
+
+            for (route, stage), seconds in sorted(stage_seconds.items()):
+                lines.append('http_request_stage_seconds_total{route="%s",stage="%s"} %f'
+                             % (ServerMetrics.escape(route), stage, seconds))
+
+            lines += ["# HELP http_request_stage_requests_total Requests timed by stage, by route",
+                      "# TYPE http_request_stage_requests_total counter"]
+
+            for route, count in sorted(stage_requests.items()):
+                lines.append('http_request_stage_requests_total{route="%s"} %d' % (ServerMetrics.escape(route), count))
+
+        counters = [("http_received_bytes_total", "Bytes of request headers and bodies received", bytes_received),
+                    ("http_sent_bytes_total", "Bytes of responses sent", bytes_sent),
+                    ("http_connections_total", "Connections managed", connections_opened)] + counters
+
+        for name, description, value in counters:
+            lines += ["# HELP " + name + " " + description, "# TYPE " + name + " counter", "%s %d" % (name, value)]
+
+        gauges = [("http_connections_active", "Connections currently managed",
+                   connections_opened - connections_closed)] + gauges
+
+        for name, description, value in gauges:
+            lines += ["# HELP " + name + " " + description, "# TYPE " + name + " gauge", "%s %s" % (name, value)]
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def escape(value: str) -> str:
+        """Returns the given string escaped to be used as a label value in the Prometheus text format"""
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SamplingProfiler:
+    """
+    A class that captures a sampling profile of all threads of the server for a while and writes it to disk
+
+    A background thread takes the stack of every other thread at a fixed interval. The stacks are counted and
+    written in the collapsed format of flame graph tools, one stack per line with its frames from the outermost
+    to the innermost separated by semicolons, followed by the number of samples. The server runs at full speed
+    when no profile is captured, and only slows down by the sampling while one is.
+
+    Attributes
+    ----------
+    SamplingProfiler.INTERVAL: float
+        a static float specifying the seconds between two samples
+    SamplingProfiler.DURATION: float
+        a static float specifying the default seconds a profile is captured
+    SamplingProfiler.MAX_DURATION: float
+        a static float specifying the maximum seconds a profile can be captured
+    SamplingProfiler.directory: str
+        a static string specifying the directory profiles are written to
+    SamplingProfiler.lock: threading.Lock
+        a static lock making sure only one profile is captured at a time
+    SamplingProfiler.thread: threading.Thread
+        the static background thread capturing the current profile, or None
+    """
+
+    INTERVAL: float = 0.005
+    DURATION: float = 30.0
+    MAX_DURATION: float = 300.0
+
+    directory: str = tempfile.gettempdir()
+    lock: threading.Lock = threading.Lock()
+    thread: threading.Thread = None
+
+    @staticmethod
+    def start(duration: float = DURATION) -> str:
+        """Start capturing a profile in the background
+
+        Parameters
+        ----------
+        duration: float
+            The seconds to capture the profile, at most SamplingProfiler.MAX_DURATION
+
+        Returns
+        -------
+        str
+            Returns the path the profile will be written to, or None if a profile is being captured already
+        """
+        duration = min(duration, SamplingProfiler.MAX_DURATION)
+        path = os.path.join(SamplingProfiler.directory, "profile-%d-%d.txt" % (os.getpid(), time.time()))
+
+        with SamplingProfiler.lock:
+            if SamplingProfiler.thread is not None and SamplingProfiler.thread.is_alive():
+                return None
+
+            SamplingProfiler.thread = threading.Thread(target=SamplingProfiler.run, args=(duration, path),
+                                                       name="profiler", daemon=True)
+            SamplingProfiler.thread.start()
+
+        ServerLog.logger.info("capturing a profile for %.1f seconds to %s", duration, path)
+        return path
+
+    @staticmethod
+    def run(duration: float, path: str):
+        """Sample the stacks of all other threads for the given seconds and write them to the given path"""
+        own_id = threading.get_ident()
+        stacks = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                frames = []
+
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                  code.co_firstlineno))
+                    frame = frame.f_back
+
+                frames.append(names.get(thread_id, "thread"))
+                stacks[";".join(reversed(frames))] += 1
+
+            samples += 1
+            time.sleep(SamplingProfiler.INTERVAL)
+
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+
+        ServerLog.logger.info("profile of %d samples written to %s", samples, path)
+
+    @staticmethod
+    def handle_signal(signum: int, frame):
+        """Signal handler capturing a profile for SamplingProfiler.DURATION seconds"""
+        if SamplingProfiler.start() is None:
+            ServerLog.logger.warning("a profile is being captured already")
+
+
+class ClientLimiter:
+    """
+    A class where an object limits the request rate and the number of open connections of every client address
+
+    Every address has a token bucket holding up to burst tokens, refilled with rate tokens per second. A request
+    takes a token, and is refused while the bucket is empty. The state of at most max_clients addresses is kept,
+    least recently seen first. An address without open connections whose bucket is full again is in the same
+    state as a new one, so it expires and is forgotten when a new address is added. When the table is full, the
+    least recently seen address is forgotten, even if it has open connections, so a flood of addresses can not
+    exhaust the memory; its connections are then no longer counted.
+    The object is shared by all clients and safe to use from several threads.
+
+    Attributes
+    ----------
+    ClientLimiter.BURST: int
+        a static integer specifying the default number of requests a client can send at once, after being idle
+    ClientLimiter.MAX_CLIENTS: int
+        a static integer specifying the default maximum number of addresses whose state is kept
+    ClientLimiter.EXPIRE_COUNT: int
+        a static integer specifying the maximum number of expired addresses forgotten when a new address is added
+    rate: float
+        the requests per second a client can send in the long run, or None for no request rate limit
+    burst: float
+        the number of tokens a bucket holds when it is full
+    max_connections: int
+        the maximum number of open connections of a client, or None for no connection limit
+    max_clients: int
+        the maximum number of addresses whose state is kept
+    clients: collections.OrderedDict
+        a dictionary mapping every known address to a list with the tokens in its bucket, the monotonic time they
+        were counted and its open connections, least recently seen first
+    lock: threading.Lock
+        the lock protecting the clients
+    """
+
+    BURST: int = 50
+    MAX_CLIENTS: int = 65536
+    EXPIRE_COUNT: int = 2
+
+    rate: float
+    burst: float
+    max_connections: int
+    max_clients: int
+    clients: collections.OrderedDict
+    lock: threading.Lock
+
+    def __init__(self, rate: float = None, burst: int = BURST, max_connections: int = None,
+                 max_clients: int = MAX_CLIENTS):
+        self.rate = rate
+        self.burst = float(max(burst, 1))
+        self.max_connections = max_connections
+        self.max_clients = max(max_clients, 1)
+        self.clients = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow_request(self, address: str) -> bool:
+        """Take a token from the bucket of the given address for a new request
+
+        Parameters
+        ----------
+        address: str
+            The address of the client
+
+        Returns
+        -------
+        bool
+            True if the request can be answered, False if the client exceeded its rate
+        """
+        if self.rate is None:
+            return True
+
+        now = time.monotonic()
+
+        with self.lock:
+            state = self.__get_state(address, now)
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+
+            if tokens < 1.0:
+                state[0] = tokens
+                return False
+
+            state[0] = tokens - 1.0
+            return True
+
+    def acquire_connection(self, address: str) -> bool:
+        """Count a new connection of the given address, if it has room for it
+
+        Parameters
+        ----------
+        address: str
+            The address of the client
+
+        Returns
+        -------
+        bool
+            True if the connection is counted, False if the client has too many open connections already
+        """
+        if self.max_connections is None:
+            return True
+
+        with self.lock:
+            state = self.__get_state(address, time.monotonic())
+
+            if state[2] >= self.max_connections:
+                return False
+
+            state[2] += 1
+            return True
+
+    def release_connection(self, address: str):
+        """Stop counting a connection of the given address that was counted by acquire_connection
+
+        Parameters
+        ----------
+        address: str
+            The address of the client
+        """
+        if self.max_connections is None:
+            return
+
+        with self.lock:
+            state = self.clients.get(address)
+
+            # the address may have been forgotten while the connection was open
+            if state is not None and state[2] > 0:
+                state[2] -= 1
+
+    def __get_state(self, address: str, now: float) -> list:
+        """Returns the state of the given address, adding it if it is not known, while holding the lock
+
+        Parameters
+        ----------
+        address: str
+            The address of the client
+        now: float
+            The current monotonic time
+
+        Returns
+        -------
+        list
+            Returns the tokens, the time they were counted and the open connections of the address
+        """
+        state = self.clients.get(address)
+
+        if state is not None:
+            self.clients.move_to_end(address)
+            return state
+
+        # forgetting a few of the least recently seen addresses for every new one bounds the table without a sweep
+        for _ in range(ClientLimiter.EXPIRE_COUNT):
+            if not self.clients:
+                break
+
+            oldest, oldest_state = next(iter(self.clients.items()))
+
+            if len(self.clients) < self.max_clients and not self.__is_expired(oldest_state, now):
+                break
+
+            del self.clients[oldest]
+
+        state = [self.burst, now, 0]
+        self.clients[address] = state
+        return state
+
+    def __is_expired(self, state: list, now: float) -> bool:
+        """Returns True if the given state equals that of a new address, so it does not have to be kept
+
+        Parameters
+        ----------
+        state: list
+            The tokens, the time they were counted and the open connections of an address
+        now: float
+            The current monotonic time
+
+        Returns
+        -------
+        bool
+            True if the address has no open connections and its bucket is full again
+        """
+        if state[2] > 0:
+            return False
+
+        return self.rate is None or state[0] + (now - state[1]) * self.rate >= self.burst
+
+
+class Exchange:
+    """
+    A class where an object represents a request and the decisions taken to answer it
+
+    Both engines make the same decisions with the methods of HttpServer taking an Exchange, and only do the reading
+    and sending themselves, so they answer every request alike.
+
+    Attributes
+    ----------
+    request: Request
+        the request, valid or not
+    start: float
+        the value of time.perf_counter() when the request header was received
+    received: int
+        the number of bytes of the request header, and of the body once it is going to be read
+    command: str
+        the command of a valid request, or None
+    file: str
+        the requested file of a valid request, or None
+    upload: bool
+        True if the request is a valid PUT or POST request whose body still has to be dealt with
+    content_length: int
+        the length of the body of an upload in bytes
+    status_code: int
+        the status code of an upload, decided before its body is read
+    body: str
+        "save" if the body of the upload is stored, "skip" if it is read and thrown away, or None if it is not read
+    append: bool
+        True if a saved body is appended to the file, False if it replaces the file
+    expect_continue: bool
+        True if the client waits for a 100 Continue response before it sends the body that is read
+    close: bool
+        True if the connection is closed after the response
+    unread: bool
+        True if a body of the request may be left unread, the connection is then closed lingering
+    response: HttpResponse
+        the response to send, or None while it has not been created
+    """
+
+    __slots__ = ("request", "start", "received", "command", "file", "upload", "content_length", "status_code", "body",
+                 "append", "expect_continue", "close", "unread", "response")
+
+    request: Request
+    start: float
+    received: int
+    command: str
+    file: str
+    upload: bool
+    content_length: int
+    status_code: int
+    body: str
+    append: bool
+    expect_continue: bool
+    close: bool
+    unread: bool
+    response: HttpResponse
+
+    def __init__(self, request: Request, start: float, received: int):
+        self.request = request
+        self.start = start
+        self.received = received
+        self.command = None
+        self.file = None
+        self.upload = False
+        self.content_length = 0
+        self.status_code = 0
+        self.body = None
+        self.append = False
+        self.expect_continue = False
+        self.close = HttpServer.is_connection_close(request)
+        self.unread = False
+        self.response = None
+
+
+class HttpServer:
+    """
+    A class where an object represents an HTTP server
+
+    Attributes
+    ----------
+    HttpServer.PORT: int
+        a static integer specifying the port to use for communication between server and clients
+    HttpServer.HEADER: int
+        a static integer specifying the maximum bytes to be received at once, and the initial size of the buffer
+        kept for every client
+    HttpServer.FORMAT: str
+        a static string representing the format used to decode received data
+    HttpServer.DISCONNECT_MESSAGE: str
+        a static string representing the message the client has to send to disconnect from the server
+    HttpServer.MAX_UPLOAD_SIZE: int
+        a static integer specifying the default maximum size in bytes of the body of a PUT or POST request
+    HttpServer.WORKERS: int
+        a static integer specifying the default number of worker threads managing clients
+    HttpServer.QUEUE_SIZE: int
+        a static integer specifying the default number of accepted connections that can wait for a worker
+    HttpServer.BACKLOG: int
+        a static integer specifying the default number of connections the operating system queues before accept
+    HttpServer.CACHE_SIZE: int
+        a static integer specifying the default maximum number of bytes of file contents kept in the file cache
+    HttpServer.CACHE_FILE_SIZE: int
+        a static integer specifying the default size in bytes of the largest file kept in the file cache
+    HttpServer.CANNED_STATUS: dict
+        a static dictionary mapping the status codes of responses that never change, except for their date, to
+        a tuple with their reason phrase, the file with their body or None, and their other headers
+    HttpServer.CANNED_RESPONSES: dict
+        a static dictionary mapping every status code of CANNED_STATUS to a tuple with the bytes of the response
+        before the date, the bytes of the header after the date, and the body
+    HttpServer.MAX_RANGES: int
+        a static integer specifying the maximum number of ranges in a Range header, larger sets are ignored
+    HttpServer.ENCODINGS: tuple
+        a static tuple with the supported content codings, in order of preference
+    HttpServer.COMPRESSIBLE_TYPES: tuple
+        a static tuple with the media types, or prefixes of them, that are worth compressing
+    HttpServer.METRICS_PATH: str
+        a static string specifying the default path reserved for the metrics of the server
+    HttpServer.COALESCE_SIZE: int
+        a static integer specifying the maximum bytes of responses to pipelined requests held back to be sent at once
+    HttpServer.IDLE_TIMEOUT: float
+        a static float specifying the default seconds a connection may wait for the first byte of a request
+    HttpServer.HEADER_TIMEOUT: float
+        a static float specifying the default seconds a client may take to send the rest of a header
+    HttpServer.MAX_REQUESTS: int
+        a static integer specifying the default number of requests answered on one connection before it is closed
+    HttpServer.MAX_CONNECTIONS: int
+        a static integer specifying the default maximum number of open connections
+    HttpServer.MAX_BUFFERS: int
+        a static integer specifying the maximum number of buffers passed to a single sendmsg call
+    HttpServer.DRAIN_SIZE: int
+        a static integer specifying the maximum bytes of the body of a rejected upload that are still received and
+        thrown away to keep the connection open, larger bodies close the connection instead
+    HttpServer.LINGER_SIZE: int
+        a static integer specifying the maximum bytes still received and thrown away when a connection with an unread
+        body is closed, so the client reads the response before the connection is reset
+    HttpServer.LINGER_TIMEOUT: float
+        a static float specifying the maximum seconds spent receiving and throwing away bytes when a connection with an
+        unread body is closed
+    HttpServer.CONTINUE_RESPONSE: bytes
+        a static bytes object with the interim response asking a client that sent "Expect: 100-continue" for the body
+    HttpServer.CONTENT_TYPES: dict
+        a static dictionary mapping lowercase file extensions to their media type
+    HttpServer.DEFAULT_CONTENT_TYPE: str
+        a static string with the media type of files with an unknown extension
+    ipv4: str
+        a string representing the IPv4 address of the server
+    addr: tuple
+        a tuple of length 2 with the first position being the IPv4 address and the second being the port
+    max_upload_size: int
+        an integer specifying the maximum size in bytes of the body of a PUT or POST request
+    workers: int
+        an integer specifying the number of worker threads managing clients
+    connections: queue.Queue
+        a bounded queue of accepted connections, as (socket, address) tuples, waiting for a worker
+    file_cache: FileCache
+        the cache of small files shared by all clients
+    metrics_path: str
+        the path answered with the metrics of the server in the Prometheus text format, or None to disable it
+    idle_timeout: float
+        the seconds a connection may wait for the first byte of a request before it is closed, or None
+    header_timeout: float
+        the seconds a client may take to send the rest of a header, and for every receive or send after it, or None
+    max_requests: int
+        the number of requests answered on one connection before it is closed
+    max_connections: int
+        the maximum number of open connections, including those waiting for a worker
+    open_connections: int
+        the number of connections accepted and not closed yet
+    idle_connections: collections.OrderedDict
+        a dictionary mapping every connection waiting for a request to a function closing it, longest waiting first
+    connection_lock: threading.Lock
+        the lock protecting open_connections and idle_connections
+    stream_handlers: dict
+        a dictionary mapping paths to a tuple of the handler generating their responses and their content type
+    file_writer: FileWriter
+        the writer coordinating the uploads of all clients
+    stage_timing: bool
+        True to time the stages of every request of the threading engine and export them per route with the metrics
+    profile_path: str
+        the path starting a sampling profile of the server with a GET request, or None to disable it
+    tcp_nodelay: bool
+        True to disable Nagle's algorithm on every connection, so small responses are sent without delay
+    tcp_cork: bool
+        True to cork the connection while the header and the file of a response are sent, so the header shares
+        its packet with the start of the file
+    document_index: DocumentIndex
+        the metadata of every file that can be served, used to answer 404 and to validate the file cache without
+        system calls, or None to look every file up on disk
+    client_limiter: ClientLimiter
+        the request rate and connection limits of every client address
+
+    """
+
+    PORT: int = 5055
+    HEADER: int = 65536
+    FORMAT: str = 'latin-1'
+    REQUESTS = ["GET", "HEAD", "PUT", "POST"]
+    DISCONNECT_MESSAGE: str = "DISCONNECT"
+    MAX_UPLOAD_SIZE: int = 100 * 1024 * 1024
+    WORKERS: int = 32
+    QUEUE_SIZE: int = 64
+    BACKLOG: int = 128
+    CACHE_SIZE: int = 32 * 1024 * 1024
+    CACHE_FILE_SIZE: int = 256 * 1024
+    CANNED_STATUS: dict = {
+        204: ("No Content", None, ""),
+        304: ("Not Modified", None, ""),
+        400: ("Bad Request", "/bad_request.html", ""),
+        404: ("Not Found", "/not_found.html", ""),
+        413: ("Payload Too Large", None, "Content-Length: 0\r\nConnection: close"),
+        416: ("Range Not Satisfiable", None, "Content-Length: 0"),
+        417: ("Expectation Failed", None, "Content-Length: 0\r\nConnection: close"),
+        429: ("Too Many Requests", None, "Retry-After: 1\r\nContent-Length: 0"),
+        431: ("Request Header Fields Too Large", None, "Content-Length: 0\r\nConnection: close"),
+        500: ("Internal Server Error", "/internal_server_error.html", ""),
+        501: ("Not Implemented", None, "Content-Length: 0"),
+        503: ("Service Unavailable", None, "Retry-After: 1\r\nContent-Length: 0\r\nConnection: close"),
+    }
+    CANNED_RESPONSES: dict = {}
+    MAX_RANGES: int = 16
+    ENCODINGS: tuple = ("gzip", "deflate")
+    COMPRESSIBLE_TYPES: tuple = ("text/", "application/javascript", "application/json", "application/xml",
+                                 "image/svg+xml")
+    METRICS_PATH: str = "/metrics"
+    COALESCE_SIZE: int = 64 * 1024
+    IDLE_TIMEOUT: float = 15.0
+    HEADER_TIMEOUT: float = 10.0
+    MAX_REQUESTS: int = 1000
+    MAX_CONNECTIONS: int = 1024
+    MAX_BUFFERS: int = 64
+    DRAIN_SIZE: int = 64 * 1024
+    LINGER_SIZE: int = 1024 * 1024
+    LINGER_TIMEOUT: float = 2.0
+    CONTINUE_RESPONSE: bytes = b"HTTP/1.1 100 Continue\r\n\r\n"
+    CONTENT_TYPES: dict = {
+        "html": "text/html", "htm": "text/html", "css": "text/css", "js": "application/javascript",
+        "mjs": "application/javascript", "json": "application/json", "xml": "application/xml",
+        "txt": "text/plain", "csv": "text/csv", "md": "text/markdown", "svg": "image/svg+xml",
+        "jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp",
+        "ico": "image/x-icon", "bmp": "image/bmp", "avif": "image/avif", "woff": "font/woff", "woff2": "font/woff2",
+        "ttf": "font/ttf", "otf": "font/otf", "pdf": "application/pdf", "zip": "application/zip",
+        "gz": "application/gzip", "tar": "application/x-tar", "wasm": "application/wasm", "mp3": "audio/mpeg",
+        "ogg": "audio/ogg", "wav": "audio/wav", "mp4": "video/mp4", "webm": "video/webm",
+    }
+    DEFAULT_CONTENT_TYPE: str = "application/octet-stream"
+
+    ipv4: str
+    addr: tuple
+    server: socket.socket
+    max_upload_size: int
+    workers: int
+    connections: queue.Queue
+    file_cache: FileCache
+    metrics_path: str
+    idle_timeout: float
+    header_timeout: float
+    max_requests: int
+    max_connections: int
+    open_connections: int
+    idle_connections: collections.OrderedDict
+    connection_lock: threading.Lock
+    stream_handlers: dict
+    file_writer: FileWriter
+    stage_timing: bool
+    profile_path: str
+    tcp_nodelay: bool
+    tcp_cork: bool
+    document_index: DocumentIndex
+    client_limiter: ClientLimiter
+
+    def __init__(self, max_upload_size: int = MAX_UPLOAD_SIZE, workers: int = WORKERS,
+                 queue_size: int = QUEUE_SIZE, cache_size: int = CACHE_SIZE, cache_file_size: int = CACHE_FILE_SIZE,
+                 metrics_path: str = METRICS_PATH, idle_timeout: float = IDLE_TIMEOUT,
+                 header_timeout: float = HEADER_TIMEOUT, max_requests: int = MAX_REQUESTS,
+                 max_connections: int = None, durability: str = "none", stage_timing: bool = False,
+                 profile_path: str = None, index_docroot: bool = True, rate_limit: float = None,
+                 rate_burst: int = ClientLimiter.BURST, client_connections: int = None):
+        ServerLog.logger.info("server is starting")
+        # AF_INET says we work with IPv4 addresses
+        # SOCK_STREAM says data will be streamed through the socket
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.max_upload_size = max_upload_size
+        self.workers = workers
+        self.connections = queue.Queue(maxsize=queue_size)
+        self.file_cache = FileCache(cache_size, cache_file_size)
+        self.metrics_path = metrics_path
+        self.idle_timeout = idle_timeout
+        self.header_timeout = header_timeout
+        self.max_requests = max_requests
+        # every engine has its own default, asyncio connections are cheap enough to keep many more of them open
+        self.max_connections = type(self).MAX_CONNECTIONS if max_connections is None else max_connections
+        self.open_connections = 0
+        self.idle_connections = collections.OrderedDict()
+        self.connection_lock = threading.Lock()
+        self.stream_handlers = {}
+        self.file_writer = FileWriter(durability)
+        self.stage_timing = stage_timing
+        self.profile_path = profile_path
+        self.tcp_nodelay = True
+        self.tcp_cork = hasattr(socket, "TCP_CORK")
+        # the files are served from the current directory
+        self.document_index = DocumentIndex() if index_docroot else None
+        self.client_limiter = ClientLimiter(rate_limit, rate_burst, client_connections)
+        HttpServer.load_canned_responses()
+
+    def close(self):
+        """Close the listening socket and stop keeping the document index current"""
+        self.server.close()
+
+        if self.document_index is not None:
+            self.document_index.close()
+
+    def add_stream_handler(self, path: str, handler, content_type: str = "text/plain"):
+        """Answer GET requests for the given path with the chunks generated by a handler
+
+        The chunks are sent with the chunked transfer coding as soon as they are generated, so the size of the
+        response does not have to be known up front. HEAD requests get the header only, without calling the handler.
+
+        Parameters
+        ----------
+        path: str
+            The path to answer, starting with "/"
+        handler
+            A function called with the Request, returning an iterable of bytes, or, for the asyncio engine,
+            optionally an asynchronous iterable of bytes
+        content_type: str
+            The media type of the generated response
+        """
+        self.stream_handlers[path] = (handler, content_type)
+
+    def connect(self, backlog: int = BACKLOG, reuse_port: bool = False, ipv4: str = None, port: int = PORT,
+                nodelay: bool = True, cork: bool = True):
+        """Bind the server to this machine's IPv4 address and start listening for connections.
+
+        This is the only function that should be called.
+        After connecting, a handler will be called to ask and handle http requests.
+
+        Parameters
+        ----------
+        backlog: int
+            The number of connections the operating system queues until they are accepted
+        reuse_port: bool
+            True to set SO_REUSEPORT, so several processes can bind to the same port and the kernel spreads the
+            incoming connections over them
+        ipv4: str
+            The IPv4 address to bind to, None for the address of this machine's hostname
+        port: int
+            The port to bind to, 0 to let the operating system pick a free port
+        nodelay: bool
+            True to set TCP_NODELAY on every connection, so small responses on kept-alive connections are not
+            delayed by Nagle's algorithm waiting for the acknowledgement of the previous response
+        cork: bool
+            True to set TCP_CORK while the header and the file of a response are sent, ignored on platforms without
+            TCP_CORK
+        """
+        self.ipv4 = socket.gethostbyname(socket.gethostname()) if ipv4 is None else ipv4
+        self.tcp_nodelay = nodelay
+        self.tcp_cork = cork and hasattr(socket, "TCP_CORK")
+
+        if reuse_port:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        self.server.bind((self.ipv4, port))
+        self.addr = self.server.getsockname()
+        ServerLog.logger.info("server bound to IPv4 address %s on port %d", self.ipv4, self.addr[1])
+        self.server.listen(backlog)
+        ServerLog.logger.info("server listening for connections")
+
+    def begin_exchange(self, request: Request, address: tuple, start: float, received: int) -> Exchange:
+        """Decide how to answer a request before anything else is read, shared by both engines
+
+        Invalid and rate limited requests get their response right away. For other requests only the command and
+        file are taken from the request, an upload still has to be planned with plan_upload.
+
+        Parameters
+        ----------
+        request: Request
+            The parsed request, valid or not
+        address: tuple
+            Tuple consisting of length two with respectively the IPv4 address and port of the client
+        start: float
+            The value of time.perf_counter() when the request header was received
+        received: int
+            The number of bytes of the request header
+
+        Returns
+        -------
+        Exchange
+            Returns the request with the decisions taken so far
+        """
+        exchange = Exchange(request, start, received)
+
+        if not HttpServer.is_valid_http_request(request):
+            exchange.response = HttpServer.create_invalid_request_response(request)
+            # the end of a body that is not read can not be found, so the connection can not be reused
+            exchange.unread = HttpServer.has_request_body(request)
+            exchange.close = exchange.close or exchange.unread
+        elif not self.client_limiter.allow_request(address[0]):
+            exchange.response = HttpServer.create_429_response()
+            # the body of a refused request is not read
+            exchange.unread = HttpServer.has_request_body(request)
+            exchange.close = exchange.close or exchange.unread
+        else:
+            exchange.command = request.method
+            exchange.file = HttpServer.get_file(request)
+
+            if HttpServer.is_put_or_post(request):
+                exchange.upload = True
+                exchange.content_length = HttpServer.get_content_length(request)
+
+        return exchange
+
+    def plan_upload(self, exchange: Exchange, buffered: int):
+        """Decide the status code of an upload and what happens to its body, before the body is read
+
+        Parameters
+        ----------
+        exchange: Exchange
+            An upload, as returned by begin_exchange
+        buffered: int
+            The number of bytes received after the header and not consumed yet
+        """
+        request = exchange.request
+        exchange.status_code = self.get_status_code_for_upload(request, exchange.file, exchange.content_length)
+
+        if exchange.status_code == 201 or exchange.status_code == 204:
+            exchange.body = "save"
+            exchange.expect_continue = HttpServer.expects_continue(request)
+            # a POST always appends, so concurrent POSTs creating the same file both keep their body
+            exchange.append = exchange.command == "POST"
+            exchange.received += exchange.content_length
+        elif exchange.status_code == 501 and HttpServer.can_skip_request_body(request, exchange.content_length,
+                                                                             buffered):
+            exchange.body = "skip"
+            exchange.received += exchange.content_length
+        else:
+            # the body is not read, so the connection can not be reused
+            exchange.unread = True
+            exchange.close = True
+
+    def fail_exchange(self, exchange: Exchange):
+        """Answer a request whose handling raised an unexpected exception with 500, to be called from the handler"""
+        ServerLog.logger.exception("request for %s failed", exchange.file)
+        exchange.response = HttpServer.create_500_response()
+        # the body of an upload may not have been read completely
+        exchange.unread = exchange.upload
+        exchange.close = exchange.close or exchange.upload
+
+    def end_exchange(self, exchange: Exchange, requests: int):
+        """Decide whether the connection is closed after the response, and announce it in the response
+
+        The body of a response to HEAD is dropped here, for every status code.
+
+        Parameters
+        ----------
+        exchange: Exchange
+            The request with its response
+        requests: int
+            The number of requests received on the connection so far
+        """
+        if requests >= self.max_requests:
+            exchange.close = True
+
+        if exchange.close:
+            HttpServer.set_connection_close(exchange.response)
+
+        if exchange.request.method == "HEAD":
+            # whatever the status code, a response to HEAD never has a body, or pipelined responses would be mixed up
+            exchange.response.drop_body()
+
+    @staticmethod
+    def log_exchange(address: tuple, exchange: Exchange):
+        """Log and count a request whose response has been sent
+
+        Parameters
+        ----------
+        address: tuple
+            Tuple consisting of length two with respectively the IPv4 address and port of the client
+        exchange: Exchange
+            The answered request
+        """
+        ServerLog.access(address, exchange.command, exchange.file, exchange.response, exchange.start)
+        ServerMetrics.observe(exchange.command, exchange.response, exchange.start, exchange.received)
+        ServerMetrics.finish_timer(exchange.file, exchange.response)
+
+    def __manage_client_thread(self, conn_socket: socket.socket, address: tuple):
+        """Manages a single client.
+
+        Checks the received messages of the given client for HTTP commands and acts accordingly
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket to identify the client
+        address: tuple
+            Tuple consisting of length two with respectively the IPv4 address and port of the client
+        """
+        ServerLog.logger.debug("worker started managing client %s", address[0])
+
+        if self.tcp_nodelay:
+            conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        reader = RequestReader(conn_socket, HttpServer.HEADER)
+        output = bytearray()
+        requests = 0
+        connected = True
+
+        while connected:
+            # a kept-alive connection without a request in progress may be closed to make room for new connections
+            idle = requests > 0 and reader.buffered() == 0
+
+            if idle:
+                self.set_idle(conn_socket, functools.partial(conn_socket.shutdown, socket.SHUT_RDWR))
+
+            try:
+                request_header = HttpServer.get_request_header(reader, self.idle_timeout, self.header_timeout)
+            except OSError:
+                # the client closed or reset the connection, or did not send a request in time
+                break
+            finally:
+                if idle:
+                    self.set_busy(conn_socket)
+
+            requests += 1
+
+            if self.stage_timing:
+                ServerMetrics.start_timer(reader.received_at)
+
+            start = time.perf_counter()
+            ServerMetrics.mark("header")
+            request = Request.parse(request_header)
+            ServerLog.logger.debug("header received from IPv4 address %s: %s", address[0], request_header)
+            exchange = self.begin_exchange(request, address, start, len(request_header))
+            ServerMetrics.mark("parse")
+
+            if exchange.response is None:
+                try:
+                    if exchange.upload:
+                        self.plan_upload(exchange, reader.buffered())
+                        ServerMetrics.mark("lookup")
+
+                        if exchange.expect_continue:
+                            # responses held back for pipelined requests are sent in front of it
+                            HttpServer.send_response(conn_socket, HttpResponse(HttpServer.CONTINUE_RESPONSE), output)
+
+                        if exchange.body == "save":
+                            HttpServer.save_request_body(reader, exchange.content_length, exchange.file,
+                                                         exchange.append, self.file_writer)
+                            self.file_saved(exchange.file)
+                        elif exchange.body == "skip":
+                            reader.skip(exchange.content_length)
+
+                        ServerMetrics.mark("body")
+                        exchange.response = self.create_upload_response(exchange.status_code, exchange.file)
+                    else:
+                        exchange.response = self.create_get_or_head_response(exchange.command, request, exchange.file)
+                except (ConnectionError, TimeoutError):
+                    # the client went away or stalled while sending the body
+                    break
+                except Exception:
+                    self.fail_exchange(exchange)
+
+            self.end_exchange(exchange, requests)
+            ServerMetrics.mark("build")
+            # answers to pipelined requests are coalesced, the last one flushes them
+            more = not exchange.close and reader.has_header()
+
+            if not HttpServer.send_response(conn_socket, exchange.response, output, more, self.tcp_cork):
+                # the file shrunk while it was sent, the client can not find the end of the response anymore
+                exchange.close = True
+
+            ServerMetrics.mark("send")
+            HttpServer.log_exchange(address, exchange)
+            connected = not exchange.close
+
+            if exchange.close and exchange.unread:
+                HttpServer.linger(conn_socket)
+
+        conn_socket.close()
+        ServerLog.logger.debug("client thread ended")
+
+    def __worker_thread(self):
+        """Take accepted connections from the queue and manage them, one at a time"""
+        while True:
+            conn, addr = self.connections.get()
+            ServerMetrics.connection_opened()
+            ServerMetrics.set_worker_busy(True)
+
+            try:
+                self.__manage_client_thread(conn, addr)
+            except OSError:
+                # sending the response failed, the client is gone
+                conn.close()
+                ServerLog.logger.debug("client thread ended")
+            except Exception:
+                # the worker keeps running, only this connection is lost
+                ServerLog.logger.exception("managing client %s failed", addr[0])
+                conn.close()
+            finally:
+                ServerMetrics.set_worker_busy(False)
+                ServerMetrics.connection_closed()
+                self.release_connection(conn)
+                self.client_limiter.release_connection(addr[0])
+
+    def loop(self):
+        """Loop to execute as long as server is online
+
+        This function will manage connections
+        Accepted connections are queued for a fixed number of worker threads. When the queue is full, the
+        connection is answered with 503 and closed right away instead of slowing down every other client. A client
+        that has too many open connections already is answered with 429 the same way.
+        """
+        disconnect = False
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.__worker_thread, daemon=True).start()
+
+        ServerLog.logger.info("%d worker threads started", self.workers)
+
+        while not disconnect:
+            # To use accept(), server must be bound to an address and listening for connections
+            # conn is a new socket object usable to send and receive data
+            # addr is address bound to socket on other side of the connection
+            conn, addr = self.server.accept()  # accept() is blocking method untill client connects
+            ServerLog.logger.debug("new connection: %s accepted", addr[0])
+
+            if not self.client_limiter.acquire_connection(addr[0]):
+                ServerLog.logger.warning("too many connections of client, connection %s refused", addr[0])
+                HttpServer.shed_connection(conn, HttpServer.create_429_response())
+                continue
+
+            if not self.admit_connection(self.open_connections >= self.workers):
+                ServerLog.logger.warning("too many open connections, connection %s refused", addr[0])
+                self.client_limiter.release_connection(addr[0])
+                HttpServer.shed_connection(conn)
+                continue
+
+            try:
+                self.connections.put_nowait((conn, addr))
+            except queue.Full:
+                ServerLog.logger.warning("all workers busy, connection %s refused", addr[0])
+                self.release_connection(conn)
+                self.client_limiter.release_connection(addr[0])
+                HttpServer.shed_connection(conn)
+
+    def admit_connection(self, busy: bool) -> bool:
+        """Count a new connection, if the server has room for it
+
+        When the server is full or busy, the kept-alive connection that has been waiting for the next request the
+        longest is closed, so idle keep-alive connections can never lock out new clients.
+
+        Parameters
+        ----------
+        busy: bool
+            True if the new connection has to wait before it is managed, so an idle connection should make room
+
+        Returns
+        -------
+        bool
+            True if the connection is counted, False if it has to be refused
+        """
+        with self.connection_lock:
+            full = self.open_connections >= self.max_connections
+            evicted = False
+
+            if (full or busy) and self.idle_connections:
+                _, close = self.idle_connections.popitem(last=False)
+                evicted = True
+
+                try:
+                    close()
+                except OSError:
+                    pass
+
+            if full and not evicted:
+                return False
+
+            self.open_connections += 1
+            return True
+
+    def release_connection(self, connection):
+        """Stop counting a connection that ended
+
+        Parameters
+        ----------
+        connection
+            The socket or stream of the connection, as given to set_idle
+        """
+        with self.connection_lock:
+            self.open_connections -= 1
+            self.idle_connections.pop(connection, None)
+
+    def set_idle(self, connection, close):
+        """Mark a connection as waiting for a request, so it may be closed to make room for a new connection
+
+        Parameters
+        ----------
+        connection
+            The socket or stream of the connection
+        close
+            A function without arguments closing the connection, called while holding the connection lock
+        """
+        with self.connection_lock:
+            self.idle_connections[connection] = close
+
+    def set_busy(self, connection):
+        """Mark a connection as handling a request, it is not closed to make room for new connections anymore
+
+        Parameters
+        ----------
+        connection
+            The socket or stream of the connection, as given to set_idle
+        """
+        with self.connection_lock:
+            self.idle_connections.pop(connection, None)
+
+    @staticmethod
+    def shed_connection(conn_socket: socket.socket, response: HttpResponse = None):
+        """Answer a connection that can not be managed with 503, or the given response, and close it
+
+        The socket is made non-blocking first, so a client that does not read can never stall the accept loop.
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket of the connection to refuse
+        response: HttpResponse
+            A response without body to send instead of 503
+        """
+        conn_socket.setblocking(False)
+
+        if response is None:
+            response = HttpServer.create_503_response()
+        else:
+            HttpServer.set_connection_close(response)
+
+        try:
+            conn_socket.send(response.header)
+        except OSError:
+            pass
+
+        conn_socket.close()
+
+    @staticmethod
+    def send_response(conn_socket: socket.socket, response: HttpResponse, output: bytearray = None,
+                      more: bool = False, cork: bool = False) -> bool:
+        """Send the given response to the client and close its file, if any
+
+        The held back responses, header, in-memory body and parts are handed to send_buffers together, without
+        joining them first. A file body is sent with socket.sendfile, which copies it from the page cache to the
+        socket in the kernel with os.sendfile, and only falls back to reading chunks and sending them when that is
+        not supported. With cork, the connection is corked until the file is sent, so the header does not leave in
+        a packet of its own.
+        When the client pipelines requests, small responses are held back in output and sent together with the
+        response to the last buffered request, so a burst of requests is answered with a single send.
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket to identify the client
+        response: HttpResponse
+            The response to send
+        output: bytearray
+            The responses held back so far, sent in front of this response and emptied, or None
+        more: bool
+            True if the next request is buffered already, so a small response may be held back in output
+        cork: bool
+            True to set TCP_CORK while the header and the file of a response are sent
+
+        Returns
+        -------
+        bool
+            True if the whole response was sent or held back, False if the file ended before the announced number
+            of bytes
+        """
+        corked = False
+        response.measure()
+
+        try:
+            if output is not None:
+                if more and response.file is None and response.chunks is None and not response.parts \
+                        and len(output) + len(response.header) + len(response.body) <= HttpServer.COALESCE_SIZE:
+                    output += response.header
+                    output += response.body
+                    return True
+
+            if cork and response.file is not None:
+                conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+                corked = True
+
+            HttpServer.send_buffers(conn_socket, [output or b'', response.header, response.body, *response.parts])
+
+            if output:
+                output.clear()
+
+            if response.chunks is not None:
+                return HttpServer.send_chunks(conn_socket, response.chunks)
+
+            if response.file is None or response.count == 0:
+                # socket.sendfile refuses a count of 0, the file of an empty response has nothing to send
+                return True
+
+            return conn_socket.sendfile(response.file, response.offset, response.count) == response.count
+        finally:
+            response.close()
+
+            if corked:
+                # uncorking sends the last partial packet right away
+                with contextlib.suppress(OSError):
+                    conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    @staticmethod
+    def send_buffers(conn_socket: socket.socket, buffers: list):
+        """Send the given buffers one after the other, without copying them into a single buffer first
+
+        The buffers are passed to sendmsg together, at most HttpServer.MAX_BUFFERS at a time, so the kernel gathers
+        them into as few packets as possible. A partial write is continued from the first byte that was not sent,
+        so nothing is dropped when the socket buffer is full. Platforms without sendmsg send the buffers one by one.
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket to identify the client
+        buffers: list
+            A list of bytes-like objects, empty ones are skipped
+        """
+        if not hasattr(conn_socket, "sendmsg"):
+            for buffer in buffers:
+                conn_socket.sendall(buffer)
+
+            return
+
+        views = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+        first = 0
+
+        try:
+            while first < len(views):
+                sent = conn_socket.sendmsg(views[first:first + HttpServer.MAX_BUFFERS])
+
+                while sent > 0 and sent >= len(views[first]):
+                    sent -= len(views[first])
+                    first += 1
+
+                if sent > 0:
+                    views[first] = views[first][sent:]
+        finally:
+            # a bytearray can not be resized while a view on it exists
+            for view in views:
+                view.release()
+
+    @staticmethod
+    def send_chunks(conn_socket: socket.socket, chunks) -> bool:
+        """Send the given chunks with the chunked transfer coding, followed by the last chunk
+
+        Every chunk is sent as soon as it is generated. sendall blocks while the socket buffer is full, so a client
+        that reads slowly also slows down the generation of the chunks.
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket to identify the client
+        chunks
+            An iterable of bytes
+
+        Returns
+        -------
+        bool
+            True if all chunks were sent, False if generating them failed and the response is cut off
+        """
+        try:
+            for chunk in chunks:
+                if chunk:
+                    HttpServer.send_buffers(conn_socket, HttpServer.frame_chunk(chunk))
+        except OSError:
+            raise
+        except Exception:
+            ServerLog.logger.exception("generating a streamed response failed")
+            return False
+
+        conn_socket.sendall(b"0\r\n\r\n")
+        return True
+
+    @staticmethod
+    def frame_chunk(chunk: bytes) -> list:
+        """Returns the given data as a single chunk of the chunked transfer coding
+
+        Parameters
+        ----------
+        chunk: bytes
+            The data of the chunk, not empty as an empty chunk ends the body
+
+        Returns
+        -------
+        list
+            Returns the buffers of the chunk: the size in hexadecimal and its line ending, the data itself and its
+            line ending, so the data does not have to be copied
+        """
+        return [b"%x\r\n" % len(chunk), chunk, b"\r\n"]
+
+    @staticmethod
+    def get_request_header(reader: RequestReader, idle_timeout: float = None, header_timeout: float = None) -> str:
+        """Get the header of the request of the client specified by the given reader
+
+        Any bytes received after the header stay buffered in the reader for the body or the next request.
+        A header longer than Request.MAX_HEADER_SIZE is cut off, Request.parse rejects it.
+
+        Parameters
+        ----------
+        reader: RequestReader
+            Reader buffering the data received from the client
+        idle_timeout: float
+            The seconds to wait for the first byte of the header, None to wait forever
+        header_timeout: float
+            The seconds to wait for the rest of the header, None to wait forever
+
+        Returns
+        -------
+        str
+            Returns the received header as a string
+        """
+        return reader.read_header(idle_timeout, header_timeout, Request.MAX_HEADER_SIZE).decode(HttpServer.FORMAT)
+
+    @staticmethod
+    def linger(conn_socket: socket.socket):
+        """Close the sending side of a connection with an unread body and throw away what the client still sends
+
+        Closing a socket with unread bytes resets the connection, which may discard the response before the client
+        read it. At most HttpServer.LINGER_SIZE bytes are received, for at most HttpServer.LINGER_TIMEOUT seconds,
+        the socket is closed by the caller afterwards.
+
+        Parameters
+        ----------
+        conn_socket: socket.socket
+            Socket of the client, the response is sent already
+        """
+        deadline = time.monotonic() + HttpServer.LINGER_TIMEOUT
+        drained = 0
+
+        try:
+            conn_socket.shutdown(socket.SHUT_WR)
+
+            while drained < HttpServer.LINGER_SIZE:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                conn_socket.settimeout(remaining)
+                chunk = conn_socket.recv(HttpServer.HEADER)
+
+                if not chunk:
+                    break
+
+                drained += len(chunk)
+        except OSError:
+            # the client reset the connection or kept sending until the timeout
+            pass
+
+    @staticmethod
+    def set_connection_close(response: HttpResponse):
+        """Add the Connection: close header to the given response, unless it has it already
+
+        Parameters
+        ----------
+        response: HttpResponse
+            The last response sent on a connection
+        """
+        if b"\r\nConnection: close\r\n" not in response.header:
+            response.header = response.header[:-2] + b"Connection: close\r\n\r\n"
+
+    @staticmethod
+    def has_request_body(request: Request) -> bool:
+        """Returns True if the given request may be followed by a body
+
+        Parameters
+        ----------
+        request: Request
+            A parsed request, valid or not
+
+        Returns
+        -------
+        bool
+            True if the request has a Content-Length or Transfer-Encoding header
+        """
+        return "content-length" in request.headers or "transfer-encoding" in request.headers
+
+    @staticmethod
+    def get_content_length(request: Request) -> int:
+        """Returns the value of the Content-Length header of the given request
+
+        Parameters
+        ----------
+        request: Request
+            A valid request, whose Content-Length header is checked by is_valid_http_request
+
+        Returns
+        -------
+        int
+            Returns the length of the body in bytes, 0 if the request has no Content-Length header
+        """
+        return int(request.get("Content-Length", "0"))
+
+    @staticmethod
+    def get_request_body(reader: RequestReader, content_length: int, destination):
+        """Stream the body of the request of the client specified by the given reader into a file object
+
+        Only call this function if you are sure there is a body for the request.
+        The body is written in chunks as it is received, so it is never held in memory as a whole.
+
+        Parameters
+        ----------
+        reader: RequestReader
+            Reader buffering the data received from the client
+        content_length: int
+            The length of the body in bytes
+        destination
+            A binary file object to write the body to
+        """
+        reader.read_into(destination, content_length)
+
+    @staticmethod
+    def save_request_body(reader: RequestReader, content_length: int, file: str, append: bool, writer: FileWriter):
+        """Store the body of a PUT or POST request in the given file
+
+        When appending, the body is spooled and appended to the file, which is created if it does not exist yet,
+        together with the appends of other clients once it has been received. Otherwise it is streamed into a
+        temporary file in the same directory, which atomically replaces the given file once the whole body has been
+        received. A client that disconnects halfway therefore never leaves a truncated file behind.
+
+        Parameters
+        ----------
+        reader: RequestReader
+            Reader buffering the data received from the client
+        content_length: int
+            The length of the body in bytes
+        file: str
+            Filename, starting with a "/", to store the body in
+        append: bool
+            True if the body has to be appended to the file, False if it has to replace the file
+        writer: FileWriter
+            The writer coordinating the uploads of all clients
+        """
+        upload = UploadFile(file[1:], append, writer)
+
+        try:
+            HttpServer.get_request_body(reader, content_length, upload)
+            upload.commit()
+        except BaseException:
+            upload.abort()
+            raise
+
+    @staticmethod
+    def is_valid_http_request(request: Request) -> bool:
+        """Determine whether the given parsed request is a valid HTTP request
+
+        To be a valid HTTP request, the request must:
+            - have a header that could be parsed
+            - begin with a supported HTTP command
+            - must have a filename as the second word
+            - must have HTTP/1.1 specified as the third word
+            - must have a Content-Length header consisting of digits, if it has one
+
+        Parameters
+        ----------
+        request: Request
+            An HTTP request, parsed from its header
+
+        Returns
+        -------
+        bool
+            True if the conditions specified above are met, False otherwise
+        """
+        if request.error is not None:
+            return False
+        if request.method not in HttpServer.REQUESTS:
+            return False
+        if request.version != "HTTP/1.1":
+            return False
+        if request.method == "PUT" or request.method == "POST":
+            # see if there aren't any directories preceding the file
+            if request.target.count("/") > 1:
+                return False
+
+        content_length = request.get("Content-Length")
+
+        if content_length is not None and not (content_length.isdigit() and content_length.isascii()):
+            return False
+
+        return True
+
+    @staticmethod
+    def get_file(request: Request) -> str:
+        """Given a valid request, return the requested file
+
+        Parameters
+        ----------
+        request: Request
+            An HTTP request, parsed from its header
+
+        Returns
+        -------
+        str
+            The requested file, starting with a "/", where "/" itself is replaced by "/index.html"
+        """
+        file = request.target
+
+        if file == "/":
+            file = "/index.html"
+
+        return file
+
+    @staticmethod
+    def is_connection_close(request: Request) -> bool:
+        """Determine whether the connection has to be closed after the response
+
+        Parameters
+        ----------
+        request: Request
+            An HTTP request, parsed from its header
+
+        Returns
+        -------
+        bool
+            True if the Connection header of the request has the close option, in any case, or if the header was too
+            large to be read completely, False otherwise
+        """
+        if request.error == 431:
+            return True
+
+        connection = request.get("Connection")
+
+        if connection is None:
+            return False
+
+        return "close" in (option.strip().lower() for option in connection.split(","))
+
+    @staticmethod
+    def is_put_or_post(request: Request) -> bool:
+        """Given a valid request, determine whether the HTTP command is PUT or POST
+
+        Parameters
+        ----------
+        request: Request
+            An HTTP request, parsed from its header
+
+        Returns
+        -------
+        bool
+            True if the HTTP command is PUT or POST, False otherwise
+
+        """
+        return request.method == "PUT" or request.method == "POST"
+
+    @staticmethod
+    def is_file(file: str, index: DocumentIndex = None) -> bool:
+        """Determine whether the specified file is a regular file
+
+        Parameters
+        ----------
+        file: str
+            Filename, starting with a "/"
+        index: DocumentIndex
+            The index to look the file up in, or None to look it up on disk
+
+        Returns
+        -------
+        bool
+            True if the file exists and is a regular file, False otherwise
+        """
+        if index is not None:
+            return index.get(file[1:]) is not None
+
+        return os.path.isfile(file[1:])
+
+    @staticmethod
+    def is_modified(request: Request, etag: str, mtime_ns: int) -> bool:
+        """Evaluate the If-None-Match and If-Modified-Since headers of a request against a file
+
+        If-None-Match takes precedence, If-Modified-Since is only used when there is no If-None-Match header.
+        Dates are compared as whole seconds since the epoch, the precision of an HTTP date.
+
+        Parameters
+        ----------
+        request: Request
+            The GET request
+        etag: str
+            The entity tag of the file, including quotes
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+
+        Returns
+        -------
+        bool
+            False if the client already has the current version of the file, True otherwise
+        """
+        if_none_match = request.get("If-None-Match")
+
+        if if_none_match is not None:
+            return not HttpServer.etag_matches(if_none_match, etag)
+
+        if_modified_since = request.get("If-Modified-Since")
+
+        if if_modified_since is not None:
+            since = HttpDate.parse(if_modified_since)
+
+            if since is not None:
+                return mtime_ns // 1000000000 > since
+
+        return True
+
+    @staticmethod
+    def etag_matches(header_value: str, etag: str) -> bool:
+        """Determine whether the given entity tag is in the list of an If-None-Match or If-Match header
+
+        Tags are compared weakly, a "W/" prefix is ignored.
+
+        Parameters
+        ----------
+        header_value: str
+            The value of the header, either "*" or a comma separated list of entity tags
+        etag: str
+            The entity tag to look for, including quotes
+
+        Returns
+        -------
+        bool
+            True if the list is "*" or contains the entity tag, False otherwise
+        """
+        if header_value.strip() == "*":
+            return True
+
+        for tag in header_value.split(","):
+            tag = tag.strip()
+
+            if tag.startswith("W/"):
+                tag = tag[2:]
+
+            if tag == etag:
+                return True
+
+        return False
+
+    @staticmethod
+    def create_etag(size: int, mtime_ns: int) -> str:
+        """Returns the strong entity tag of a file with the given size and last modification time
+
+        Parameters
+        ----------
+        size: int
+            The size of the file in bytes
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+
+        Returns
+        -------
+        str
+            Returns the entity tag, including quotes
+        """
+        return '"%x-%x"' % (size, mtime_ns)
+
+    @staticmethod
+    def get_validator_data(size: int, mtime_ns: int) -> str:
+        """Returns the ETag and Last-Modified headers of a file with the given size and last modification time
+
+        Parameters
+        ----------
+        size: int
+            The size of the file in bytes
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+
+        Returns
+        -------
+        str
+            ETag and Last-Modified header, separated by CRLF
+        """
+        return "ETag: " + HttpServer.create_etag(size, mtime_ns) + "\r\nLast-Modified: " \
+            + HttpDate.format(mtime_ns // 1000000000)
+
+    @staticmethod
+    def get_ranges(request: Request, size: int, etag: str, mtime_ns: int) -> list:
+        """Returns the byte ranges of a file that are requested with the Range and If-Range headers
+
+        Parameters
+        ----------
+        request: Request
+            The GET request
+        size: int
+            The size of the file in bytes
+        etag: str
+            The entity tag of the file, including quotes
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+
+        Returns
+        -------
+        list
+            Returns None if the whole file has to be sent, otherwise a list of (first byte, last byte) tuples that
+            is empty if none of the requested ranges can be satisfied
+        """
+        range_header = request.get("Range")
+
+        if range_header is None:
+            return None
+
+        # with If-Range, the ranges only apply if the client still has the current version of the file
+        if_range = request.get("If-Range")
+
+        if if_range is not None:
+            if if_range.startswith('"'):
+                if if_range != etag:
+                    return None
+            elif if_range.startswith("W/") or HttpDate.parse(if_range) != mtime_ns // 1000000000:
+                return None
+
+        return HttpServer.parse_ranges(range_header, size)
+
+    @staticmethod
+    def parse_ranges(range_header: str, size: int) -> list:
+        """Returns the byte ranges of the value of a Range header that lie within a file of the given size
+
+        Parameters
+        ----------
+        range_header: str
+            The value of a Range header, for example: bytes=0-499,1000-,-200
+        size: int
+            The size of the file in bytes
+
+        Returns
+        -------
+        list
+            Returns None if the header is invalid or has more than HttpServer.MAX_RANGES ranges, in which case it is
+            ignored, otherwise a list of (first byte, last byte) tuples that is empty if none can be satisfied
+        """
+        unit, _, range_set = range_header.partition("=")
+        specs = range_set.split(",")
+
+        if unit.strip().lower() != "bytes" or len(specs) > HttpServer.MAX_RANGES:
+            return None
+
+        ranges = []
+
+        for spec in specs:
+            first, dash, last = spec.strip().partition("-")
+
+            if not dash or (first and not first.isdigit()) or (last and not last.isdigit()) or not first + last:
+                return None
+
+            if not first:
+                # a suffix range: the last bytes of the file
+                start = max(size - int(last), 0)
+                end = size - 1
+
+                if int(last) == 0:
+                    continue
+            else:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+
+                if last and int(last) < start:
+                    return None
+
+            if start < size:
+                ranges.append((start, end))
+
+        return ranges
+
+    @staticmethod
+    def get_status_code_for_put_or_post(request: Request, file: str, index: DocumentIndex = None) -> int:
+        """Returns the status code if a PUT or POST request was received
+
+        Only HTML bodies are accepted. The media type is compared without its parameters and ignoring case, so
+        for example "text/HTML; charset=utf-8" is accepted as well.
+
+        Parameters
+        ----------
+        request: Request
+            The PUT or POST request
+        file: str
+            Filename, starting with a "/" to get the specified file
+        index: DocumentIndex
+            The index to look the file up in, or None to look it up on disk
+
+        Returns
+        -------
+        int
+            Returns either the status code 200, 201 or 501
+        """
+        if file == "/":
+            file = "/index.html"
+
+        if request.get("Content-Type", "").partition(";")[0].strip().lower() != "text/html":
+            return 501
+
+        if not HttpServer.is_file(file, index):
+            return 201
+
+        return 204
+
+    @staticmethod
+    def expects_continue(request: Request) -> bool:
+        """Determine whether the client waits for a 100 Continue response before it sends the body
+
+        Parameters
+        ----------
+        request: Request
+            The PUT or POST request
+
+        Returns
+        -------
+        bool
+            True if the request has an "Expect: 100-continue" header, in any case, False otherwise
+        """
+        expect = request.get("Expect")
+        return expect is not None and expect.lower() == "100-continue"
+
+    @staticmethod
+    def can_skip_request_body(request: Request, content_length: int, buffered: int) -> bool:
+        """Determine whether the body of a refused upload is cheap enough to receive and throw away
+
+        Otherwise the connection is closed after the response instead, so a large refused upload costs nothing.
+        The body of a request that expects 100 Continue may never be sent, and a body without Content-Length can
+        not be found, so the connection is closed for those as well.
+
+        Parameters
+        ----------
+        request: Request
+            The refused PUT or POST request
+        content_length: int
+            The length of the body in bytes
+        buffered: int
+            The number of bytes received after the header already
+
+        Returns
+        -------
+        bool
+            True if at most HttpServer.DRAIN_SIZE bytes of the body are still to be received, False otherwise
+        """
+        if "expect" in request.headers or "transfer-encoding" in request.headers:
+            return False
+
+        return content_length - buffered <= HttpServer.DRAIN_SIZE
+
+    def get_status_code_for_upload(self, request: Request, file: str, content_length: int) -> int:
+        """Returns the status code for a PUT or POST request, before its body is read
+
+        Only the header is looked at, so an upload that is refused never has to be received.
+
+        Parameters
+        ----------
+        request: Request
+            The PUT or POST request
+        file: str
+            Filename, starting with a "/" to get the specified file
+        content_length: int
+            The length of the body of the request in bytes
+
+        Returns
+        -------
+        int
+            Returns either the status code 201, 204, 413, 417 or 501
+        """
+        if "transfer-encoding" in request.headers:
+            # only bodies framed by Content-Length are supported
+            return 501
+
+        expect = request.get("Expect")
+
+        if expect is not None and expect.lower() != "100-continue":
+            return 417
+
+        if content_length > self.max_upload_size:
+            return 413
+
+        return HttpServer.get_status_code_for_put_or_post(request, file, self.document_index)
+
+    @staticmethod
+    def get_content_data(file: str, size: int = None) -> str:
+        """Returns the Content-Length and Content-Type headers of the specified file
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/", to compute content data from
+        size: int
+            The size of the file in bytes if it is already known, None to look it up
+
+        Returns
+        -------
+        str
+            Content-Length and Content-Type header, separated by CRLF
+        """
+        content_type = HttpServer.get_content_type(file)
+
+        if size is None:
+            size = os.stat(file[1:]).st_size
+
+        content_length = "Content-Length: " + str(size)
+
+        return content_length + "\r\n" + content_type
+
+    @staticmethod
+    def get_content_type(file: str) -> str:
+        """Returns the Content-Type header of the specified file
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/", to compute the content type of
+
+        Returns
+        -------
+        str
+            Content-Type header, with the media type of the extension in HttpServer.CONTENT_TYPES
+        """
+        name = file.rpartition("/")[2]
+        extension = name.rpartition(".")[2].lower() if "." in name else ""
+        content_type = HttpServer.CONTENT_TYPES.get(extension, HttpServer.DEFAULT_CONTENT_TYPE)
+        return "Content-Type: " + content_type
+
+    @staticmethod
+    def is_compressible(file: str) -> bool:
+        """Determine whether the content type of the specified file is worth compressing
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/"
+
+        Returns
+        -------
+        bool
+            True for text-like content types, False for content types that are already compressed, like JPEG
+        """
+        return HttpServer.get_content_type(file)[len("Content-Type: "):].startswith(HttpServer.COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def get_encoding_data(file: str, encoding: str) -> str:
+        """Returns the Content-Encoding and Vary headers for the specified file sent with the given content coding
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/"
+        encoding: str
+            The content coding of the body, or None if it is not compressed
+
+        Returns
+        -------
+        str
+            The headers, each preceded by CRLF, or an empty string if the file is never compressed
+        """
+        if not HttpServer.is_compressible(file):
+            return ""
+
+        if encoding is None:
+            return "\r\nVary: Accept-Encoding"
+
+        return "\r\nContent-Encoding: " + encoding + "\r\nVary: Accept-Encoding"
+
+    @staticmethod
+    def get_encoding(request: Request) -> str:
+        """Returns the preferred content coding of the client that the server supports
+
+        The Accept-Encoding header is parsed with its quality values, a quality of 0 refuses a coding. Among the
+        codings with the highest quality, the first one of HttpServer.ENCODINGS wins.
+
+        Parameters
+        ----------
+        request: Request
+            The request that has already been received from the client
+
+        Returns
+        -------
+        str
+            Returns "gzip" or "deflate", or None if the body should not be compressed
+        """
+        accept_encoding = request.get("Accept-Encoding")
+
+        if not accept_encoding:
+            return None
+
+        qualities = {}
+
+        for coding in accept_encoding.split(","):
+            name, _, parameters = coding.partition(";")
+            quality = 1.0
+            parameters = parameters.strip()
+
+            if parameters.startswith("q="):
+                try:
+                    quality = float(parameters[2:])
+                except ValueError:
+                    quality = 0.0
+
+            qualities[name.strip().lower()] = quality
+
+        best_encoding = None
+        best_quality = 0.0
+
+        for encoding in HttpServer.ENCODINGS:
+            quality = qualities.get(encoding, qualities.get("*", 0.0))
+
+            if quality > best_quality:
+                best_encoding = encoding
+                best_quality = quality
+
+        return best_encoding
+
+    @staticmethod
+    def open_precompressed(path: str, mtime_ns: int):
+        """Open the gzip-compressed sibling of a file, with the same path and the extension .gz
+
+        Parameters
+        ----------
+        path: str
+            The path of the file
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+
+        Returns
+        -------
+        file
+            Returns the sibling opened in binary mode, or None if it does not exist or is older than the file
+        """
+        try:
+            f = open(path + ".gz", mode='rb')
+        except OSError:
+            return None
+
+        st = os.fstat(f.fileno())
+
+        if not stat.S_ISREG(st.st_mode) or st.st_mtime_ns < mtime_ns:
+            f.close()
+            return None
+
+        return f
+
+    @staticmethod
+    def create_body(file: str) -> bytes:
+        """Returns the contents of the given files as bytes
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/", to gather content from
+
+        Returns
+        -------
+        bytes
+            Content of the file in bytes
+        """
+        f = open(file[1:], mode='rb')
+        body = f.read()
+        f.close()
+        return body
+
+    def create_get_or_head_response(self, command: str, request: Request, file: str) -> HttpResponse:
+        """Returns the response to a GET or HEAD request
+
+        Small files are answered from the file cache, larger files are sent from disk.
+
+        Parameters
+        ----------
+        command: str
+            Either "GET" or "HEAD"
+        request: Request
+            The GET or HEAD request
+        file: str
+            Filename, starting with a "/", that was requested
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 200, 206, 304, 404 or 416 status code, the body of a response to HEAD
+            is dropped by end_exchange
+        """
+        if file == self.metrics_path:
+            return self.create_metrics_response(command)
+
+        if self.profile_path is not None and file.partition("?")[0] == self.profile_path:
+            return self.create_profile_response(command, file)
+
+        if file in self.stream_handlers:
+            return self.create_stream_response(command, request, file)
+
+        if DocumentIndex.is_hidden(file):
+            # a partial upload, without an index it would be opened from disk
+            return HttpServer.create_404_response()
+
+        info = None
+
+        if self.document_index is not None:
+            info = self.document_index.get(file[1:])
+
+            if info is None:
+                ServerMetrics.mark("lookup")
+                return HttpServer.create_404_response()
+
+        entry = self.file_cache.get(file[1:], info)
+        ServerMetrics.mark("lookup")
+        # ranges are only served from the uncompressed file
+        encoding = None
+
+        if HttpServer.is_compressible(file) and request.get("Range") is None:
+            encoding = HttpServer.get_encoding(request)
+
+        if entry is not None:
+            if encoding is not None:
+                entry = self.file_cache.get_variant(file[1:], entry, encoding) or entry
+
+            if command == "GET" and not HttpServer.is_modified(request, entry.etag, entry.mtime_ns):
+                return HttpServer.create_304_response(entry.validators)
+
+            ranges = None
+
+            if command == "GET":
+                ranges = HttpServer.get_ranges(request, entry.size, entry.etag, entry.mtime_ns)
+
+            if ranges is not None:
+                if not ranges:
+                    return HttpServer.create_416_response(entry.size)
+
+                return HttpServer.create_206_response(file, ranges, entry.size, entry.mtime_ns, body=entry.body)
+
+            return HttpServer.create_200_response_from_cache(entry)
+
+        # the file is opened once, its status code and headers are all taken from the opened file
+        try:
+            f = open(file[1:], mode='rb')
+        except OSError:
+            return HttpServer.create_404_response()
+
+        st = os.fstat(f.fileno())
+        ServerMetrics.mark("lookup")
+
+        if not stat.S_ISREG(st.st_mode):
+            f.close()
+            return HttpServer.create_404_response()
+
+        # a file too large for the cache is only sent compressed if a precompressed sibling exists
+        compressed = None
+
+        if encoding == "gzip":
+            compressed = HttpServer.open_precompressed(file[1:], st.st_mtime_ns)
+
+        if compressed is not None:
+            f.close()
+            f = compressed
+            st = os.fstat(f.fileno())
+        else:
+            encoding = None
+
+        etag = HttpServer.create_etag(st.st_size, st.st_mtime_ns)
+
+        if command == "GET" and not HttpServer.is_modified(request, etag, st.st_mtime_ns):
+            f.close()
+            validators = "\r\n" + HttpServer.get_validator_data(st.st_size, st.st_mtime_ns) \
+                + HttpServer.get_encoding_data(file, None)
+            return HttpServer.create_304_response(validators.encode(HttpServer.FORMAT))
+
+        ranges = None
+
+        if command == "GET":
+            ranges = HttpServer.get_ranges(request, st.st_size, etag, st.st_mtime_ns)
+
+        if ranges is not None:
+            if not ranges:
+                f.close()
+                return HttpServer.create_416_response(st.st_size)
+
+            return HttpServer.create_206_response(file, ranges, st.st_size, st.st_mtime_ns, f=f)
+
+        # status code is 200
+        return HttpServer.create_200_response(file, f, encoding)
+
+    def file_saved(self, file: str):
+        """Forget the cached contents and metadata of a file the body of a request was stored in
+
+        Parameters
+        ----------
+        file: str
+            Filename, starting with a "/"
+        """
+        self.file_cache.invalidate(file[1:])
+
+        if self.document_index is not None:
+            self.document_index.update(file[1:])
+
+    def create_upload_response(self, status_code: int, file: str) -> HttpResponse:
+        """Returns the response to a PUT or POST request once its body has been handled
+
+        Parameters
+        ----------
+        status_code: int
+            The status code returned by get_status_code_for_upload
+        file: str
+            Filename, starting with a "/", the body was stored in
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the given status code
+        """
+        if status_code == 204:
+            return HttpServer.create_204_response()
+        elif status_code == 201:
+            return self.create_201_response(file)
+        elif status_code == 413:
+            return HttpServer.create_413_response()
+        elif status_code == 417:
+            return HttpServer.create_417_response()
+        else:  # status code is 501
+            return HttpServer.create_501_response()
+
+    @staticmethod
+    def create_200_response(file: str, f=None, encoding: str = None) -> HttpResponse:
+        """Returns the header and body for the 200 status code
+
+        The body is not read into memory. The file is opened and sent after the header by send_response, and the
+        Content-Length, ETag and Last-Modified are taken from the opened file so they always match the bytes that
+        are sent.
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/" to gather data from to compute a correct header and body
+        f
+            The file, already opened in binary mode, or None to open it
+        encoding: str
+            The content coding f is compressed with, or None if f is the file itself
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 200 OK status code
+        """
+        date = HttpDate.now()
+
+        if f is None:
+            f = open(file[1:], mode='rb')
+
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        content_data = HttpServer.get_content_data(file, size)
+        validator_data = HttpServer.get_validator_data(size, st.st_mtime_ns)
+
+        encoding_data = HttpServer.get_encoding_data(file, encoding)
+
+        header = "HTTP/1.1 200 OK" + "\r\nDate: " + date + "\r\n" + content_data + encoding_data + "\r\n" \
+            + validator_data + "\r\nAccept-Ranges: bytes\r\n\r\n"
+        raw_header = header.encode(HttpServer.FORMAT)
+        return HttpResponse(raw_header, file=f, count=size)
+
+    @staticmethod
+    def create_206_response(file: str, ranges: list, size: int, mtime_ns: int, f=None,
+                            body: bytes = None) -> HttpResponse:
+        """Returns the header and body for the 206 status code
+
+        The ranges are taken from either an opened file or the contents of a cached file, without copying them.
+        A single range of a file is sent with sendfile starting at its offset. For several ranges, the file is
+        memory-mapped and every range is sent as a view on the mapping, so they are served from the page cache
+        shared by all clients.
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/", the ranges are part of
+        ranges: list
+            A non-empty list of (first byte, last byte) tuples, as returned by get_ranges
+        size: int
+            The size of the file in bytes
+        mtime_ns: int
+            The last modification time of the file in nanoseconds
+        f
+            The file, opened in binary mode, or None if body is given
+        body: bytes
+            The contents of the file, or None if f is given
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 206 Partial Content status code
+        """
+        date = HttpDate.now()
+        content_type = HttpServer.get_content_type(file)
+        header = "HTTP/1.1 206 Partial Content" + "\r\nDate: " + date + "\r\n" \
+            + HttpServer.get_validator_data(size, mtime_ns) + "\r\n"
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            header += "Content-Range: bytes " + str(start) + "-" + str(end) + "/" + str(size) + "\r\nContent-Length: " \
+                + str(end - start + 1) + "\r\n" + content_type + "\r\n\r\n"
+            raw_header = header.encode(HttpServer.FORMAT)
+
+            if body is not None:
+                return HttpResponse(raw_header, memoryview(body)[start:end + 1])
+
+            return HttpResponse(raw_header, file=f, offset=start, count=end - start + 1)
+
+        mapping = None
+
+        if body is None:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+            body = mapping
+
+        boundary = os.urandom(12).hex()
+        parts = []
+
+        with memoryview(body) as view:
+            for start, end in ranges:
+                part_header = "\r\n--" + boundary + "\r\n" + content_type + "\r\nContent-Range: bytes " + str(start) \
+                    + "-" + str(end) + "/" + str(size) + "\r\n\r\n"
+                parts.append(part_header.encode(HttpServer.FORMAT))
+                parts.append(view[start:end + 1])
+
+        parts.append(("\r\n--" + boundary + "--\r\n").encode(HttpServer.FORMAT))
+        content_length = sum(len(part) for part in parts)
+        header += "Content-Length: " + str(content_length) + "\r\nContent-Type: multipart/byteranges; boundary=" \
+            + boundary + "\r\n\r\n"
+        return HttpResponse(header.encode(HttpServer.FORMAT), parts=parts, mapping=mapping)
+
+    @staticmethod
+    def create_200_response_from_cache(entry: CacheEntry) -> HttpResponse:
+        """Returns the header and body for the 200 status code of a file in the file cache
+
+        Only the status line and date are created, the other headers and the body are taken from the cache.
+
+        Parameters
+        ----------
+        entry: CacheEntry
+            The cached file to respond with
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 200 OK status code
+        """
+        date = HttpDate.now()
+        header = "HTTP/1.1 200 OK" + "\r\nDate: " + date + "\r\n"
+        raw_header = header.encode(HttpServer.FORMAT) + entry.headers
+        return HttpResponse(raw_header, entry.body)
+
+    def create_stream_response(self, command: str, request: Request, file: str) -> HttpResponse:
+        """Returns the response generated by the stream handler of the given path
+
+        Parameters
+        ----------
+        command: str
+            Either "GET" or "HEAD"
+        request: Request
+            The GET or HEAD request
+        file: str
+            The path of a stream handler, starting with a "/"
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header for the 200 OK status code and the chunks of the body, without chunks for HEAD
+        """
+        handler, content_type = self.stream_handlers[file]
+        header = "HTTP/1.1 200 OK" + "\r\nDate: " + HttpDate.now() + "\r\nContent-Type: " + content_type \
+            + "\r\nTransfer-Encoding: chunked\r\nCache-Control: no-store\r\n\r\n"
+
+        if command == "HEAD":
+            return HttpResponse(header.encode(HttpServer.FORMAT))
+
+        return HttpResponse(header.encode(HttpServer.FORMAT), chunks=handler(request))
+
+    def get_worker_gauges(self) -> list:
+        """Returns the gauges of the worker threads managing clients
+
+        Returns
+        -------
+        list
+            Returns a list of tuples of the name, help text and current value of the gauges
+        """
+        return [("http_workers", "Worker threads managing clients", self.workers),
+                ("http_workers_busy", "Worker threads currently managing a client", ServerMetrics.busy_workers()),
+                ("http_connections_queued", "Accepted connections waiting for a worker", self.connections.qsize())]
+
+    def create_metrics_response(self, command: str) -> HttpResponse:
+        """Returns the response with the metrics of the server in the Prometheus text format
+
+        Parameters
+        ----------
+        command: str
+            Either "GET" or "HEAD"
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 200 OK status code, without a body for HEAD
+        """
+        with self.file_cache.lock:
+            counters = [("file_cache_hits_total", "Lookups answered from the file cache", self.file_cache.hits),
+                        ("file_cache_misses_total", "Lookups that had to read the file into the cache",
+                         self.file_cache.misses)]
+            gauges = [("file_cache_bytes", "Bytes of file contents in the file cache", self.file_cache.size),
+                      ("file_cache_files", "Files in the file cache", len(self.file_cache.entries))]
+
+        body = ServerMetrics.export(counters, gauges + self.get_worker_gauges()).encode(HttpServer.FORMAT)
+        header = "HTTP/1.1 200 OK" + "\r\nDate: " + HttpDate.now() + "\r\nContent-Length: " + str(len(body)) \
+            + "\r\nContent-Type: text/plain; version=0.0.4\r\nCache-Control: no-store\r\n\r\n"
+
+        if command == "HEAD":
+            body = b''
+
+        return HttpResponse(header.encode(HttpServer.FORMAT), body)
+
+    def create_profile_response(self, command: str, file: str) -> HttpResponse:
+        """Returns the response to a request for the profile path, starting a profile for a GET request
+
+        The number of seconds to profile can be given in the query, for example /profile?seconds=10.
+
+        Parameters
+        ----------
+        command: str
+            Either "GET" or "HEAD"
+        file: str
+            The requested path, including the query
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 202 Accepted status code with the path of the profile in the body,
+            the 400 status code for an invalid number of seconds, or the 409 Conflict status code if a profile is
+            being captured already. HEAD only gets 200 OK without starting a profile.
+        """
+        if command == "HEAD":
+            status = "200 OK"
+            body = b''
+        else:
+            query = urllib.parse.parse_qs(file.partition("?")[2])
+
+            try:
+                duration = float(query.get("seconds", [SamplingProfiler.DURATION])[0])
+            except ValueError:
+                duration = -1.0
+
+            if not 0 < duration <= SamplingProfiler.MAX_DURATION:
+                return HttpServer.create_400_response()
+
+            path = SamplingProfiler.start(duration)
+
+            if path is None:
+                status = "409 Conflict"
+                body = b"a profile is being captured already\n"
+            else:
+                status = "202 Accepted"
+                body = (path + "\n").encode(HttpServer.FORMAT)
+
+        header = "HTTP/1.1 " + status + "\r\nDate: " + HttpDate.now() + "\r\nContent-Length: " + str(len(body)) \
+            + "\r\nContent-Type: text/plain\r\nCache-Control: no-store\r\n\r\n"
+        return HttpResponse(header.encode(HttpServer.FORMAT), body)
+
+    def create_201_response(self, file: str) -> HttpResponse:
+        """Returns the header and body for the 201 status code
+
+        Parameters
+        ----------
+        file: str
+            File, starting with "/", to gather data from to compute a correct header and body
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 201 Created status code
+        """
+        date = HttpDate.now()
+        location = "http://" + self.ipv4 + ":" + str(self.addr[1]) + file
+        # without a Content-Length, a client on a kept-alive connection would wait for a body
+        header = "HTTP/1.1 201 Created" + "\r\nDate: " + date + "\r\nLocation:" + location \
+            + "\r\nContent-Length: 0\r\n\r\n"
+        return HttpResponse(header.encode(HttpServer.FORMAT))
+
+    @staticmethod
+    def create_204_response() -> HttpResponse:
+        """Returns the header and body for the 204 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 204 No Content status code
+        """
+        return HttpServer.create_canned_response(204)
+
+    @staticmethod
+    def create_304_response(validators: bytes = b'') -> HttpResponse:
+        """Returns the header for the 304 status code, a 304 response never has a body
+
+        Parameters
+        ----------
+        validators: bytes
+            The ETag and Last-Modified headers of the file, each preceded by CRLF
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 304 Not Modified status code
+        """
+        return HttpServer.create_canned_response(304, validators)
+
+    @staticmethod
+    def create_400_response() -> HttpResponse:
+        """Returns the header and body for the 400 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 400 Bad Request status code
+        """
+        return HttpServer.create_canned_response(400)
+
+    @staticmethod
+    def create_404_response() -> HttpResponse:
+        """Returns the header and body for the 404 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 404 Not Found status code
+        """
+        return HttpServer.create_canned_response(404)
+
+    @staticmethod
+    def create_413_response() -> HttpResponse:
+        """Returns the header and body for the 413 status code
+
+        The connection is closed after this response, since the body of the request is not read.
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 413 Payload Too Large status code
+        """
+        return HttpServer.create_canned_response(413)
+
+    @staticmethod
+    def create_416_response(size: int) -> HttpResponse:
+        """Returns the header and body for the 416 status code
+
+        Parameters
+        ----------
+        size: int
+            The size of the file none of the requested ranges lie in
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 416 Range Not Satisfiable status code
+        """
+        content_range = "\r\nContent-Range: bytes */" + str(size)
+        return HttpServer.create_canned_response(416, content_range.encode(HttpServer.FORMAT))
+
+    @staticmethod
+    def create_417_response() -> HttpResponse:
+        """Returns the header and body for the 417 status code
+
+        The connection is closed after this response, since it is unknown whether the client sends the body.
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 417 Expectation Failed status code
+        """
+        return HttpServer.create_canned_response(417)
+
+    @staticmethod
+    def create_429_response() -> HttpResponse:
+        """Returns the header and body for the 429 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 429 Too Many Requests status code
+        """
+        return HttpServer.create_canned_response(429)
+
+    @staticmethod
+    def create_431_response() -> HttpResponse:
+        """Returns the header and body for the 431 status code
+
+        The connection is closed after this response, since the rest of the header is not read.
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 431 Request Header Fields Too Large status code
+        """
+        return HttpServer.create_canned_response(431)
+
+    @staticmethod
+    def create_invalid_request_response(request: Request) -> HttpResponse:
+        """Returns the response to a request that is not a valid HTTP request
+
+        Parameters
+        ----------
+        request: Request
+            A request for which is_valid_http_request returned False
+
+        Returns
+        -------
+        HttpResponse
+            Returns the 431 response if the header exceeds the limits of Request, the 400 response otherwise
+        """
+        if request.error == 431:
+            return HttpServer.create_431_response()
+
+        return HttpServer.create_400_response()
+
+    @staticmethod
+    def create_500_response() -> HttpResponse:
+        """Returns the header and body for the 500 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 500 Internal Server Error status code
+        """
+        return HttpServer.create_canned_response(500)
+
+    @staticmethod
+    def create_501_response() -> HttpResponse:
+        """Returns the header and body for the 501 status code
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 501 Not Implemented status code
+        """
+        return HttpServer.create_canned_response(501)
+
+    @staticmethod
+    def create_503_response() -> HttpResponse:
+        """Returns the header and body for the 503 status code
+
+        The connection is closed after this response.
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the 503 Service Unavailable status code
+        """
+        return HttpServer.create_canned_response(503)
+
+    @staticmethod
+    def create_canned_response(status_code: int, extra_headers: bytes = b'') -> HttpResponse:
+        """Returns a response that only differs from the preloaded template of the given status code in its date
 
         Parameters
         ----------
-        conn_socket: socket.socket
-            Socket to identify the client
-        address: tuple
-            Tuple consisting of length two with respectively the IPv4 address and port of the client
+        status_code: int
+            A status code in HttpServer.CANNED_STATUS
+        extra_headers: bytes
+            Headers to add right after the date, each preceded by CRLF
+
+        Returns
+        -------
+        HttpResponse
+            Returns the header and body for the given status code
         """
-        print("[THREAD] new thread started for client")
-        connected = True
+        if not HttpServer.CANNED_RESPONSES:
+            HttpServer.load_canned_responses()
 
-        while connected:
-            request_header = HttpServer.get_request_header(conn_socket)
-            split_request_header = request_header.split()
-            file = split_request_header[1]
-            print("[RECV] header received from IPv4 address", address[0], ":", request_header)
+        before_date, after_date, body = HttpServer.CANNED_RESPONSES[status_code]
+        raw_header = before_date + HttpDate.now_bytes() + extra_headers + after_date
+        return HttpResponse(raw_header, body)
 
-            if not HttpServer.is_valid_http_request(split_request_header):
-                http_message = HttpServer.create_400_response()
-                pass
-            else:
-                if file == "/":
-                    file = "/index.html"
+    @staticmethod
+    def load_canned_responses():
+        """Build the templates of all responses in HttpServer.CANNED_STATUS and store them in
+        HttpServer.CANNED_RESPONSES
 
-                put_or_post = HttpServer.is_put_or_post(split_request_header)
+        The HTML files of the responses are read once. This is done when a server is created, and can be called
+        again at any time to reload changed files. Missing files result in an empty body.
+        """
+        responses = {}
+
+        for status_code, (reason, file, extra_headers) in HttpServer.CANNED_STATUS.items():
+            headers = ""
+            body = b''
+
+            if file is not None:
                 try:
-                    if put_or_post:
-                        request_body = HttpServer.get_request_body(conn_socket, request_header)
-                        status_code = HttpServer.get_status_code_for_put_or_post(request_header, file)
-
-                        if status_code == 204:
-                            if split_request_header[0] == "PUT":
-                                f = open(file[1:], "w")
-                            else:
-                                f = open(file[1:], "a")
-
-                            f.write(request_body)
-                            f.close()
-                            http_message = HttpServer.create_204_response()
-                        elif status_code == 501:
-                            http_message = HttpServer.create_501_response()
-                        else:  # status code is 201
-                            f = open(file[1:], "x")
-                            f.write(request_body)
-                            f.close()
-                            http_message = self.create_201_response(file)
+                    body = HttpServer.create_body(file)
+                    headers += HttpServer.get_content_data(file, len(body)) + "\r\n"
+                except OSError:
+                    headers += "Content-Length: 0\r\n"
 
-                    else:
-                        if split_request_header[0] == "GET":
-                            # GET needs filename
-                            status_code = HttpServer.get_status_code_for_get(request_header, file)
-                        else:
-                            status_code = HttpServer.get_status_code_for_head(file)
-
-                        if status_code == 404:
-                            http_message = HttpServer.create_404_response()
-                        elif status_code == 304:
-                            http_message = HttpServer.create_304_response()
-                        else:  # status code is 200
-                            http_message = HttpServer.create_200_response(file)
-                except Exception:
-                    http_message = HttpServer.create_500_response()
+            if extra_headers:
+                headers += extra_headers + "\r\n"
+
+            before_date = "HTTP/1.1 " + str(status_code) + " " + reason + "\r\nDate: "
+            after_date = "\r\n" + headers + "\r\n"
+            responses[status_code] = (before_date.encode(HttpServer.FORMAT), after_date.encode(HttpServer.FORMAT),
+                                      body)
+
+        # replace the whole dictionary at once, so other threads never see a partially loaded one
+        HttpServer.CANNED_RESPONSES = responses
 
-            conn_socket.send(http_message)
 
-            # determine if connection has to be closed
-            conn_str = "Connection:"
-            conn_begin_ind = request_header.find(conn_str)
+class AsyncHttpServer(HttpServer):
+    """
+    A class where an object represents an HTTP server handling all clients in one asyncio event loop
+
+    Instead of a thread per connection, every client is a coroutine on asyncio streams, so idle keep-alive
+    connections only cost a few kilobytes each. Requests are parsed and answered with the same functions as
+    HttpServer, while all file I/O is moved to the default executor to keep the event loop responsive.
+    Like the socket timeouts of HttpServer, header_timeout limits every receive of a body and every send.
+
+    Attributes
+    ----------
+    AsyncHttpServer.MAX_CONNECTIONS: int
+        a static integer specifying the default maximum number of open connections, most of them idle keep-alive
+        connections that only cost a few kilobytes each
+    AsyncHttpServer.SENDFILE_SIZE: int
+        a static integer specifying the maximum bytes of a file sent at once, each part within the timeout
+    """
 
-            if conn_begin_ind != -1:
-                conn_end_ind = request_header[conn_begin_ind:].find("\r\n") + conn_begin_ind
-                conn_status = request_header[conn_begin_ind+len(conn_str):conn_end_ind].strip()
-                if conn_status == "close":
-                    conn_socket.close()
-                    connected = False
-                    print("[THREAD] client thread ended")
+    MAX_CONNECTIONS: int = 16384
+    SENDFILE_SIZE: int = 1024 * 1024
 
     def loop(self):
         """Loop to execute as long as server is online
 
-        This function will manage connections
-        If a client disconnects, the user will be asked if the server has to shut down or not.
+        This function will run the event loop accepting and managing connections.
         """
-        disconnect = False
+        asyncio.run(self.serve())
 
-        while not disconnect:
-            print("[CONNECTION] waiting for new connection")
-            # To use accept(), server must be bound to an address and listening for connections
-            # conn is a new socket object usable to send and receive data
-            # addr is address bound to socket on other side of the connection
-            conn, addr = self.server.accept()  # accept() is blocking method untill client connects
-            print("[CONNECTION] new connection:", addr[0], "accepted.")
-            client_thread = threading.Thread(target=self.__manage_client_thread, args=(conn, addr), daemon=True)
-            client_thread.start()
+    def get_worker_gauges(self) -> list:
+        """Returns no gauges, clients are managed by the event loop instead of worker threads"""
+        return []
 
-    @staticmethod
-    def date_older_than_file_date(date_and_time: str, file: str) -> bool:
-        """Return whether the given date is older than the last modified date of the given file
+    async def serve(self):
+        """Accept connections on the listening socket and start a coroutine for every client"""
+        self.server.setblocking(False)
+        async_server = await asyncio.start_server(self.__manage_client, sock=self.server, limit=HttpServer.HEADER)
+        ServerLog.logger.info("waiting for new connections")
+
+        async with async_server:
+            await async_server.serve_forever()
+
+    async def __manage_client(self, stream_reader: asyncio.StreamReader, stream_writer: asyncio.StreamWriter):
+        """Manages a single client.
+
+        Checks the received messages of the given client for HTTP commands and acts accordingly
 
         Parameters
         ----------
-        date_and_time: str
-            Pass data: <weekday>, <day of the month> <3 first letters of month> <year> <hours:minutes:seconds> GMT
-            An example is: Thu, 18 Mar 2021 20:44:30 GMT
+        stream_reader: asyncio.StreamReader
+            Stream to receive the requests of the client from
+        stream_writer: asyncio.StreamWriter
+            Stream to send the responses to the client to
+        """
+        address = stream_writer.get_extra_info("peername")
+        ServerLog.logger.debug("new connection: %s accepted", address[0])
 
-        file: str
-            The file, starting with a "/", to get the last modified date of
+        if not self.client_limiter.acquire_connection(address[0]):
+            ServerLog.logger.warning("too many connections of client, connection %s refused", address[0])
+            http_message = HttpServer.create_429_response()
+            HttpServer.set_connection_close(http_message)
+            stream_writer.write(http_message.header)
+            stream_writer.close()
+            return
 
-        Returns
-        -------
-        bool
-            True if given date is older than the last modified date of then given file, False otherwise
-        """
-        # compare_date: 0 is monthday, 1 is monthname, 2 is year, 3 is time, 4 is GMT
-        if file[1:] == "index.html":
-            compare_date = HttpServer.INDEX_DATE_LAST_MOD.split()
-        else:
-            compare_date = HttpServer.SEA_DATE_LAST_MOD.split()
-
-        # 0 is weekday, 1 is monthday, 2 is monthname, 3 is year, 4 is time, 5 is GMT
-        split_date_and_time = date_and_time.split()
-
-        if split_date_and_time[3] == compare_date[2]:
-            if HttpServer.MONTHS.get(split_date_and_time[2]) == HttpServer.MONTHS.get(compare_date[1]):
-                if split_date_and_time[1] == compare_date[0]:
-                    # 0 is hours, 1 is minutes, 2 is seconds
-                    split_time = split_date_and_time[4].split(":")
-                    split_compare_time = compare_date[3].split(":")
-
-                    if split_time[0] == split_compare_time[0]:
-                        if split_time[1] == split_compare_time[1]:
-                            if split_time[2] == split_compare_time[2]:
-                                return True
-                            elif split_time[2] < split_compare_time[2]:
-                                return True
-                            else:
-                                return False
-                        elif split_time[1] < split_compare_time[1]:
-                            return True
-                        else:
-                            return False
-                    elif split_time[0] < split_compare_time[0]:
-                        return True
-                    else:
-                        return False
-                elif split_date_and_time[1] < compare_date[0]:
-                    return True
-                else:
-                    return False
-            elif HttpServer.MONTHS.get(split_date_and_time[2]) < HttpServer.MONTHS.get(compare_date[1]):
-                return True
-            else:
-                return False
-        elif split_date_and_time[3] < compare_date[2]:
-            return True
-        else:
-            return False
+        if not self.admit_connection(False):
+            ServerLog.logger.warning("too many open connections, connection %s refused", address[0])
+            self.client_limiter.release_connection(address[0])
+            stream_writer.write(HttpServer.create_503_response().header)
+            stream_writer.close()
+            return
 
-    @staticmethod
-    def get_request_header(conn_socket: socket.socket) -> str:
-        """Get the header of the request of the client specified by the given socket
+        ServerMetrics.connection_opened()
+        event_loop = asyncio.get_running_loop()
+        conn_socket = stream_writer.get_extra_info("socket")
 
-        Parameters
-        ----------
-        conn_socket: socket.socket
-            Socket object to identify the client
+        if not self.tcp_nodelay and conn_socket is not None:
+            # asyncio sets TCP_NODELAY on every TCP connection
+            conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
 
-        Returns
-        -------
-        str
-            Returns the received header as a string
-        """
-        raw_double_new_line = "\r\n\r\n".encode(HttpServer.FORMAT)
-        raw_request_header = conn_socket.recv(HttpServer.HEADER)
+        requests = 0
+        connected = True
 
-        while raw_double_new_line not in raw_request_header:
-            raw_request_header += conn_socket.recv(HttpServer.HEADER)
+        try:
+            while connected:
+                # a kept-alive connection without a request in progress may be closed to make room for new connections
+                if requests > 0:
+                    self.set_idle(stream_writer, stream_writer.close)
 
-        return raw_request_header.decode(HttpServer.FORMAT)
+                try:
+                    first_byte = await asyncio.wait_for(stream_reader.readexactly(1), self.idle_timeout)
+                    raw_request_header = first_byte + await asyncio.wait_for(
+                        stream_reader.readuntil(RequestReader.TERMINATOR), self.header_timeout)
+                except asyncio.LimitOverrunError:
+                    # the header does not fit in the buffer of the stream, it is rejected without reading it
+                    raw_request_header = None
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    # the client closed the connection or did not send a request in time
+                    break
+                finally:
+                    self.set_busy(stream_writer)
 
-    @staticmethod
-    def get_request_body(conn_socket: socket.socket, request_header: str) -> str:
-        """Get the body of the request of the client specified by the given socket
+                requests += 1
 
-        Only call this function if you are sure there is a body for the request
+                start = time.perf_counter()
 
-        Parameters
-        ----------
-        conn_socket: socket.socket
-            Socket object to identify the client
-        request_header: str
-            The header of the request that has already been received from the client
+                if raw_request_header is None:
+                    request = Request(error=431)
+                    received = 0
+                else:
+                    request_header = raw_request_header.decode(HttpServer.FORMAT)
+                    request = Request.parse(request_header)
+                    ServerLog.logger.debug("header received from IPv4 address %s: %s", address[0], request_header)
+                    received = len(raw_request_header)
 
-        Returns
-        -------
-        str
-            Returns the received body as a string
-        """
-        new_line = "\r\n"
-        content_header = "Content-Length:"
-        raw_body = b''
-        begin_chunksize_ind = request_header.find(content_header) + len(content_header)
-        end_chunksize_ind = request_header[begin_chunksize_ind:].find(new_line)
-        chunk_size = int(request_header[begin_chunksize_ind:begin_chunksize_ind + end_chunksize_ind])
+                exchange = self.begin_exchange(request, address, start, received)
+
+                if exchange.response is None:
+                    try:
+                        if exchange.upload:
+                            await event_loop.run_in_executor(None, self.plan_upload, exchange, 0)
 
-        while chunk_size != 0:
-            raw_body += conn_socket.recv(HttpServer.HEADER)
-            chunk_size -= 1
+                            if exchange.expect_continue:
+                                stream_writer.write(HttpServer.CONTINUE_RESPONSE)
+                                await asyncio.wait_for(stream_writer.drain(), self.header_timeout)
 
-        return raw_body.decode(HttpServer.FORMAT)
+                            if exchange.body == "save":
+                                await self.save_request_body(stream_reader, exchange.content_length, exchange.file,
+                                                             exchange.append, self.file_writer, self.header_timeout)
+                                # updating the index takes the status of the file
+                                await event_loop.run_in_executor(None, self.file_saved, exchange.file)
+                            elif exchange.body == "skip":
+                                await AsyncHttpServer.skip_request_body(stream_reader, exchange.content_length,
+                                                                        self.header_timeout)
+
+                            exchange.response = self.create_upload_response(exchange.status_code, exchange.file)
+                        else:
+                            exchange.response = await event_loop.run_in_executor(
+                                None, self.create_get_or_head_response, exchange.command, request, exchange.file)
+                    except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+                        # the client went away or stalled while sending the body
+                        break
+                    except Exception:
+                        self.fail_exchange(exchange)
+
+                self.end_exchange(exchange, requests)
+
+                if not await AsyncHttpServer.send_response(stream_writer, exchange.response, self.tcp_cork,
+                                                           self.header_timeout):
+                    # the file shrunk while it was sent, the client can not find the end of the response anymore
+                    exchange.close = True
+
+                HttpServer.log_exchange(address, exchange)
+                connected = not exchange.close
+
+                if exchange.close and exchange.unread:
+                    await AsyncHttpServer.linger(stream_reader, stream_writer)
+        except (ConnectionError, asyncio.TimeoutError):
+            # the client went away or stopped reading the response
+            pass
+        finally:
+            stream_writer.close()
+            ServerMetrics.connection_closed()
+            self.release_connection(stream_writer)
+            self.client_limiter.release_connection(address[0])
+            ServerLog.logger.debug("client connection ended")
 
     @staticmethod
-    def is_valid_http_request(split_request_header: list) -> bool:
-        """Given a request header split in separate words, determine whether it is a valid HTTP request
+    async def send_response(stream_writer: asyncio.StreamWriter, response: HttpResponse, cork: bool = False,
+                            timeout: float = None) -> bool:
+        """Send the given response to the client and close its file, if any
 
-        To be a valid HTTP request, the request must:
-            - begin with a supported HTTP command
-            - must have a filename as the second word
-            - must have HTTP/1.1 specified as the third word
+        The header, body and parts are written to the transport as separate buffers. A file body is sent with the
+        sendfile of the event loop, which uses os.sendfile when the transport allows it and otherwise falls back to
+        reading and writing chunks. The file is sent in parts of at most SENDFILE_SIZE bytes, so a client that stops
+        reading runs into the timeout. With cork, the connection is corked until the file is sent.
 
         Parameters
         ----------
-        split_request_header: list
-            An HTTP request, split up in separate words
+        stream_writer: asyncio.StreamWriter
+            Stream to send the response to the client to
+        response: HttpResponse
+            The response to send
+        cork: bool
+            True to set TCP_CORK while the header and the file of a response are sent
+        timeout: float
+            The seconds every part of the response may take to be handed to the operating system, or None
 
         Returns
         -------
         bool
-            True if the conditions specified above are met, False otherwise
+            True if the whole response was sent, False if the file ended before the announced number of bytes
         """
-        if len(split_request_header) < 3:
-            return False
-        if split_request_header[0] not in HttpServer.REQUESTS:
-            return False
-        if split_request_header[2] != "HTTP/1.1":
-            return False
-        if split_request_header[0] == "PUT" or split_request_header[0] == "POST":
-            # see if there aren't any directories preceding the file
-            occurrences = re.findall("/", split_request_header[1])
-            if len(occurrences) > 1:
-                return False
+        conn_socket = stream_writer.get_extra_info("socket")
+        corked = False
+        response.measure()
 
-        return True
+        try:
+            if cork and response.file is not None and conn_socket is not None:
+                conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+                corked = True
 
-        # return len(split_request_header) < 3 or \
-        #        split_request_header[0] not in HttpServer.REQUESTS or \
-        #        split_request_header[2] != "HTTP/1.1"
+            stream_writer.writelines([response.header, response.body, *response.parts])
 
-    @staticmethod
-    def is_put_or_post(split_request_header: list) -> bool:
-        """Given a request header split in separate words, determine whether the HTTP command is PUT or POST
+            if response.mapping is not None:
+                await AsyncHttpServer.flush(stream_writer, timeout)
+            else:
+                await asyncio.wait_for(stream_writer.drain(), timeout)
 
-        Parameters
-        ----------
-        split_request_header: list
-            An HTTP request, split up in separate words
+            if response.chunks is not None:
+                return await AsyncHttpServer.send_chunks(stream_writer, response.chunks, timeout)
 
-        Returns
-        -------
-        bool
-            True if the HTTP command is PUT or POST, False otherwise
+            if response.file is None:
+                return True
+
+            event_loop = asyncio.get_running_loop()
+            offset = response.offset
+            end = response.offset + response.count
+
+            while offset < end:
+                count = min(end - offset, AsyncHttpServer.SENDFILE_SIZE)
+                sent = await asyncio.wait_for(event_loop.sendfile(stream_writer.transport, response.file, offset,
+                                                                  count), timeout)
+                offset += sent
+
+                if sent < count:
+                    return False
 
-        """
-        if split_request_header[0] == "PUT":
-            return True
-        elif split_request_header[0] == "POST":
             return True
+        finally:
+            response.close()
 
-        return False
+            if corked:
+                with contextlib.suppress(OSError):
+                    conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
 
     @staticmethod
-    def get_status_code_for_head(file: str) -> int:
-        """Returns the status code if a HEAD request was received
+    async def flush(stream_writer: asyncio.StreamWriter, timeout: float = None):
+        """Wait until the transport has handed everything written to it to the operating system
+
+        A transport may keep the written buffers instead of copying them until they are sent, so a memory-mapped
+        file they are views of can only be closed afterwards. Lowering the write buffer limits to zero makes drain
+        wait until the write buffer is empty.
 
         Parameters
         ----------
-        file: str
-            Filename, starting with a "/" to get the specified file
-
-        Returns
-        -------
-        int
-            Returns either the status code 200 or 404
+        stream_writer: asyncio.StreamWriter
+            Stream to flush
+        timeout: float
+            The seconds to wait, or None
         """
-        if file == "/":
-            file = "/index.html"
+        transport = stream_writer.transport
+        low, high = transport.get_write_buffer_limits()
+        transport.set_write_buffer_limits(0)
 
-        if not os.path.isfile(file[1:]):
-            return 404
-
-        return 200
+        try:
+            await asyncio.wait_for(stream_writer.drain(), timeout)
+        finally:
+            transport.set_write_buffer_limits(high, low)
 
     @staticmethod
-    def get_status_code_for_get(request_header: str, file: str) -> int:
-        """Returns the status code if a GET request was received
+    async def send_chunks(stream_writer: asyncio.StreamWriter, chunks, timeout: float = None) -> bool:
+        """Send the given chunks with the chunked transfer coding, followed by the last chunk
+
+        Asynchronous iterables are iterated in the event loop. Ordinary iterables may block, so every chunk is
+        generated in the executor. Every chunk is drained before the next one is generated, so a client that reads
+        slowly also slows down the generation of the chunks.
 
         Parameters
         ----------
-        request_header: str
-            Request header of the GET request
-        file: str
-            Filename, starting with a "/" to get the specified file
+        stream_writer: asyncio.StreamWriter
+            Stream to send the chunks to the client to
+        chunks
+            An iterable or asynchronous iterable of bytes
+        timeout: float
+            The seconds every chunk may take to be handed to the operating system, or None
 
         Returns
         -------
-        int
-            Returns either the status code 200, 304 or 404
+        bool
+            True if all chunks were sent, False if generating them failed and the response is cut off
         """
-        modified = True
-        modified_header = "If-Modified-Since:"
-        if file == "/":
-            file = "/index.html"
-
-        if not os.path.isfile(file[1:]):
-            return 404
-
-        # check for If_Modified_Since
-        begin_mod_date_ind = request_header.find(modified_header)
-
-        if begin_mod_date_ind != -1:
-            new_line = "\r\n"
-            end_mod_date_ind = request_header[begin_mod_date_ind:].find(new_line) + begin_mod_date_ind
-            date_and_time = request_header[begin_mod_date_ind:end_mod_date_ind][len(modified_header):]
+        try:
+            if hasattr(chunks, "__aiter__"):
+                async for chunk in chunks:
+                    if chunk:
+                        stream_writer.writelines(HttpServer.frame_chunk(chunk))
+                        await asyncio.wait_for(stream_writer.drain(), timeout)
+            else:
+                event_loop = asyncio.get_running_loop()
+                iterator = iter(chunks)
 
-            if not HttpServer.date_older_than_file_date(date_and_time, file):
-                modified = False
+                while (chunk := await event_loop.run_in_executor(None, next, iterator, None)) is not None:
+                    if chunk:
+                        stream_writer.writelines(HttpServer.frame_chunk(chunk))
+                        await asyncio.wait_for(stream_writer.drain(), timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise
+        except Exception:
+            ServerLog.logger.exception("generating a streamed response failed")
+            return False
 
-        if modified is True:
-            return 200
-        else:
-            return 304
+        stream_writer.write(b"0\r\n\r\n")
+        await asyncio.wait_for(stream_writer.drain(), timeout)
+        return True
 
     @staticmethod
-    def get_status_code_for_put_or_post(request_header: str, file: str) -> int:
-        """Returns the status code if a PUT or POST request was received
+    async def skip_request_body(stream_reader: asyncio.StreamReader, content_length: int, timeout: float = None):
+        """Receive the body of a request in chunks without keeping it
 
         Parameters
         ----------
-        request_header: str
-            Request header of the PUT or POST request
-        file: str
-            Filename, starting with a "/" to get the specified file
-
-        Returns
-        -------
-        int
-            Returns either the status code 200, 201 or 501
+        stream_reader: asyncio.StreamReader
+            Stream to receive the body from
+        content_length: int
+            The length of the body in bytes
+        timeout: float
+            The seconds to wait for every chunk of the body, or None
         """
-        ctype = "Content-Type: text/html"
-        if file == "/":
-            file = "/index.html"
-
-        if request_header.find(ctype) == -1:
-            return 501
+        while content_length > 0:
+            chunk = await asyncio.wait_for(stream_reader.read(min(content_length, HttpServer.HEADER)), timeout)
 
-        if not os.path.isfile(file[1:]):
-            return 201
+            if not chunk:
+                raise ConnectionError("client closed the connection")
 
-        return 204
+            content_length -= len(chunk)
 
     @staticmethod
-    def get_content_data(file: str) -> str:
-        """Returns the Content-Length and Content-Type headers of the specified file
+    async def linger(stream_reader: asyncio.StreamReader, stream_writer: asyncio.StreamWriter):
+        """Close the sending side of a connection with an unread body and throw away what the client still sends
+
+        The asynchronous counterpart of HttpServer.linger, the end of the response is sent once the written data is
+        flushed. The stream is closed by the caller afterwards.
 
         Parameters
         ----------
-        file: str
-            File, starting with "/", to compute content data from
-
-        Returns
-        -------
-        str
-            Content-Length and Content-Type header, separated by CRLF
+        stream_reader: asyncio.StreamReader
+            Stream to receive the rest of the request from
+        stream_writer: asyncio.StreamWriter
+            Stream the response was written to
         """
-        file = file[1:]
-        file_extension = file.split(".")
+        event_loop = asyncio.get_running_loop()
+        deadline = event_loop.time() + HttpServer.LINGER_TIMEOUT
+        drained = 0
 
-        if file_extension[-1] == "jpg":
-            content_type = "Content-Type: image/jpeg"
-        elif file_extension[-1] == "png" or file_extension[-1] == "gif":
-            content_type = "Content-Type: image/" + file_extension[-1]
-        else:
-            content_type = "Content-Type: text/" + file_extension[-1]
+        try:
+            if stream_writer.can_write_eof():
+                stream_writer.write_eof()
 
-        content_length = "Content-Length: " + str(os.stat(file).st_size)
+            while drained < HttpServer.LINGER_SIZE:
+                remaining = deadline - event_loop.time()
 
-        return content_length + "\r\n" + content_type
+                if remaining <= 0:
+                    break
 
-    @staticmethod
-    def create_body(file: str) -> bytes:
-        """Returns the contents of the given files as bytes
+                chunk = await asyncio.wait_for(stream_reader.read(HttpServer.HEADER), remaining)
 
-        Parameters
-        ----------
-        file: str
-            File, starting with "/", to gather content from
+                if not chunk:
+                    break
 
-        Returns
-        -------
-        bytes
-            Content of the file in bytes
-        """
-        f = open(file[1:], mode='rb')
-        body = f.read()
-        f.close()
-        return body
+                drained += len(chunk)
+        except (ConnectionError, asyncio.TimeoutError):
+            # the client reset the connection or kept sending until the timeout
+            pass
 
     @staticmethod
-    def create_200_response(file: str) -> bytes:
-        """Returns the header and body for the 200 status code
+    async def save_request_body(stream_reader: asyncio.StreamReader, content_length: int, file: str, append: bool,
+                                writer: FileWriter, timeout: float = None):
+        """Store the body of a PUT or POST request in the given file
+
+        The body is received in chunks of at most HttpServer.HEADER bytes, each of them written to the file in the
+        executor, with the same guarantees as HttpServer.save_request_body.
 
         Parameters
         ----------
+        stream_reader: asyncio.StreamReader
+            Stream to receive the body from
+        content_length: int
+            The length of the body in bytes
         file: str
-            File, starting with "/" to gather data from to compute a correct header and body
-
-        Returns
-        -------
-        bytes
-            Returns the header and body for the 200 OK status code
+            Filename, starting with a "/", to store the body in
+        append: bool
+            True if the body has to be appended to the file, False if it has to replace the file
+        writer: FileWriter
+            The writer coordinating the uploads of all clients
+        timeout: float
+            The seconds to wait for every chunk of the body, or None
         """
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
-        content_data = HttpServer.get_content_data(file)
+        event_loop = asyncio.get_running_loop()
+        upload = await event_loop.run_in_executor(None, UploadFile, file[1:], append, writer)
 
-        header = "HTTP/1.1 200 OK" + "\r\nDate: " + date + "\r\n" + content_data + "\r\n\r\n"
-        print(header)
-        raw_header = header.encode(HttpServer.FORMAT)
-        raw_body = HttpServer.create_body(file)
-        response = raw_header + raw_body
+        try:
+            while content_length > 0:
+                chunk = await asyncio.wait_for(stream_reader.read(min(content_length, HttpServer.HEADER)), timeout)
 
-        return response
+                if not chunk:
+                    raise ConnectionError("client closed the connection")
 
-    def create_201_response(self, file: str) -> bytes:
-        """Returns the header and body for the 201 status code
+                await event_loop.run_in_executor(None, upload.write, chunk)
+                content_length -= len(chunk)
 
-        Parameters
-        ----------
-        file: str
-            File, starting with "/", to gather data from to compute a correct header and body
+            await event_loop.run_in_executor(None, upload.commit)
+        except BaseException:
+            upload.abort()
+            raise
 
-        Returns
-        -------
-        bytes
-            Returns the header and body for the 201 Created status code
-        """
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
-        location = "http://" + self.ipv4 + ":" + str(HttpServer.PORT) + file
-        header = "HTTP/1.1 201 Created" + "\r\nDate: " + date + "\r\nLocation:" + location + "\r\n\r\n"
 
-        print(header)
-        return header.encode(HttpServer.FORMAT)
+class PreforkServer:
+    """
+    A class where an object starts several server processes on the same port and keeps them running
 
-    @staticmethod
-    def create_204_response() -> bytes:
-        """Returns the header and body for the 204 status code
+    Every worker process runs its own server, so the server is no longer limited to one core by the GIL. When the
+    platform supports SO_REUSEPORT, every worker binds its own listening socket and the kernel balances the
+    connections. Otherwise the listening socket is bound once in the supervisor and inherited by the workers.
+    Workers that exit are restarted, and on SIGTERM or SIGINT all workers are stopped before the supervisor exits.
 
-        Returns
-        -------
-        bytes
-            Returns the header and body for the 204 No Content status code
-        """
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    Attributes
+    ----------
+    PreforkServer.SHUTDOWN_TIMEOUT: float
+        a static float specifying the seconds workers get to exit before they are killed
+    PreforkServer.RESTART_DELAY: float
+        a static float specifying the seconds to wait before restarting a worker that crashed right after starting
+    processes: int
+        an integer specifying the number of worker processes
+    create_server
+        a function without arguments returning the HttpServer each worker process runs
+    backlog: int
+        an integer specifying the listen backlog of every listening socket
+    listener: HttpServer
+        the server bound in the supervisor when SO_REUSEPORT is not available, None otherwise
+    children: dict
+        a dictionary mapping the process id of every running worker to its start time
+    running: bool
+        a boolean that is False once the supervisor is shutting down
+    """
 
-        header = "HTTP/1.1 204 No Content" + "\r\nDate: " + date + "\r\n\r\n"
+    SHUTDOWN_TIMEOUT: float = 10.0
+    RESTART_DELAY: float = 1.0
 
-        print(header)
-        return header.encode(HttpServer.FORMAT)
+    processes: int
+    backlog: int
+    listener: HttpServer
+    children: dict
+    running: bool
 
-    @staticmethod
-    def create_304_response() -> bytes:
-        """Returns the header and body for the 304 status code
+    def __init__(self, processes: int, create_server, backlog: int = HttpServer.BACKLOG):
+        self.processes = processes
+        self.create_server = create_server
+        self.backlog = backlog
+        self.listener = None
+        self.children = {}
+        self.running = True
 
-        Returns
-        -------
-        bytes
-           Returns the header and body for the 304 Not Modified status code
-        """
-        content_data = HttpServer.get_content_data("/not_modified.html")
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    def run(self):
+        """Start the worker processes and supervise them until the supervisor is asked to stop"""
+        if not hasattr(socket, "SO_REUSEPORT"):
+            self.listener = self.create_server()
+            self.listener.connect(self.backlog)
 
-        header = "HTTP/1.1 304 Not Modified" + "\r\nDate: " + date + "\r\n" + content_data + "\r\n\r\n"
-        raw_header = header.encode(HttpServer.FORMAT)
-        print(header)
-        raw_body = HttpServer.create_body("/not_modified.html")
-        response = raw_header + raw_body
+        signal.signal(signal.SIGTERM, self.__stop)
+        signal.signal(signal.SIGINT, self.__stop)
 
-        return response
+        for _ in range(self.processes):
+            self.__start_worker()
 
-    @staticmethod
-    def create_400_response() -> bytes:
-        """Returns the header and body for the 400 status code
+        ServerLog.logger.info("%d worker processes started", self.processes)
 
-        Returns
-        -------
-        bytes
-            Returns the header and body for the 400 Bad Request status code
-        """
-        content_data = HttpServer.get_content_data("/bad_request.html")
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
 
-        header = "HTTP/1.1 400 Bad Request" + "\r\nDate: " + date + "\r\n" + content_data + "\r\n\r\n"
-        raw_header = header.encode(HttpServer.FORMAT)
-        print(header)
-        raw_body = HttpServer.create_body("/bad_request.html")
-        response = raw_header + raw_body
+            start_time = self.children.pop(pid, None)
 
-        return response
+            if start_time is None or not self.running:
+                continue
 
-    @staticmethod
-    def create_404_response() -> bytes:
-        """Returns the header and body for the 404 status code
+            ServerLog.logger.warning("worker %d exited with code %d and is restarted", pid,
+                                     os.waitstatus_to_exitcode(status))
 
-        Returns
-        -------
-        bytes
-            Returns the header and body for the 404 Not Found status code
-        """
-        content_data = HttpServer.get_content_data("/not_found.html")
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+            if time.monotonic() - start_time < PreforkServer.RESTART_DELAY:
+                # do not burn the CPU on a worker that crashes at startup
+                time.sleep(PreforkServer.RESTART_DELAY)
 
-        header = "HTTP/1.1 404 Not Found" + "\r\nDate: " + date + "\r\n" + content_data + "\r\n\r\n"
-        raw_header = header.encode(HttpServer.FORMAT)
-        print(header)
-        raw_body = HttpServer.create_body("/not_found.html")
-        response = raw_header + raw_body
+            if self.running:
+                self.__start_worker()
 
-        return response
+        ServerLog.logger.info("all workers stopped")
 
-    @staticmethod
-    def create_500_response() -> bytes:
-        """Returns the header and body for the 500 status code
+    def __start_worker(self):
+        """Fork a new worker process running a server"""
+        pid = os.fork()
 
-        Returns
-        -------
-        bytes
-           Returns the header and body for the 500 Internal Server Error status code
-        """
-        content_data = HttpServer.get_content_data("/internal_server_error.html")
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        if pid != 0:
+            self.children[pid] = time.monotonic()
+            return
 
-        header = "HTTP/1.1 500 Internal Server Error" + "\r\nDate: " + date + "\r\n" + content_data + "\r\n\r\n"
-        raw_header = header.encode(HttpServer.FORMAT)
-        print(header)
-        raw_body = HttpServer.create_body("/internal_server_error.html")
-        response = raw_header + raw_body
+        # in the worker process
+        exit_code = 0
+        signal.signal(signal.SIGTERM, PreforkServer.__exit_worker)
+        signal.signal(signal.SIGINT, PreforkServer.__exit_worker)
+
+        try:
+            if self.listener is None:
+                server = self.create_server()
+                server.connect(self.backlog, reuse_port=True)
+            else:
+                server = self.listener
 
-        return response
+            server.loop()
+        except SystemExit:
+            pass
+        except BaseException as e:
+            ServerLog.logger.critical("worker %d crashed: %r", os.getpid(), e)
+            exit_code = 1
+        finally:
+            # os._exit skips the cleanup of the interpreter, so the queued records are written first
+            ServerLog.stop()
+            os._exit(exit_code)
 
-    @staticmethod
-    def create_501_response() -> bytes:
-        """Returns the header and body for the 501 status code
+    def __stop(self, signum: int, frame):
+        """Signal handler asking all workers to exit, and killing those that are still running after a timeout"""
+        if not self.running:
+            return
 
-        Returns
-        -------
-        bytes
-           Returns the header and body for the 501 Not Implemented status code
-        """
-        date = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        ServerLog.logger.info("stopping workers")
+        self.running = False
+
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        timer = threading.Timer(PreforkServer.SHUTDOWN_TIMEOUT, self.__kill_workers)
+        timer.daemon = True
+        timer.start()
+
+    def __kill_workers(self):
+        """Kill all workers that did not exit after being asked to"""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
 
-        header = "HTTP/1.1 501 Not Implemented" + "\r\nDate: " + date + "\r\n\r\n"
-        print(header)
-        return header.encode(HttpServer.FORMAT)
+    @staticmethod
+    def __exit_worker(signum: int, frame):
+        """Signal handler ending a worker process"""
+        raise SystemExit(0)
 
 
 if __name__ == "__main__":
-    server = HttpServer()
-    server.connect()
-    server.loop()
+    parser = argparse.ArgumentParser(description="HTTP server serving the files in the current directory")
+    parser.add_argument("--engine", choices=["threading", "asyncio"], default="threading",
+                        help="manage clients with a pool of worker threads or all in one asyncio event loop")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of server processes sharing the port, restarted when they exit")
+    parser.add_argument("--durability", choices=FileWriter.DURABILITY_MODES, default="none",
+                        help="sync uploaded data to the disk before answering, appends are synced in groups")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="lowest level of the messages to log, DEBUG includes every request header")
+    parser.add_argument("--access-log-sample", type=int, default=1,
+                        help="log one in every N requests, 0 disables access logs")
+    parser.add_argument("--stage-timing", action="store_true",
+                        help="time the stages of every request per route and export them with the metrics, "
+                             "threading engine only")
+    parser.add_argument("--profile-path",
+                        help="path starting a sampling profile with GET, for example /profile?seconds=10, "
+                             "disabled by default; SIGUSR1 starts one as well")
+    parser.add_argument("--profile-directory", default=SamplingProfiler.directory,
+                        help="directory sampling profiles are written to")
+    parser.add_argument("--no-document-index", action="store_true",
+                        help="look every requested file up on disk instead of keeping an index of the document root")
+    parser.add_argument("--max-connections", type=int,
+                        help="maximum open connections, including idle keep-alive ones, the idle connection waiting "
+                             "the longest is closed to make room; %d for threading and %d for asyncio by default, "
+                             "the limit of open files may have to be raised as well"
+                             % (HttpServer.MAX_CONNECTIONS, AsyncHttpServer.MAX_CONNECTIONS))
+    parser.add_argument("--rate-limit", type=float,
+                        help="requests per second every client address can send in the long run, answered with 429 "
+                             "beyond it; every process keeps its own limits; unlimited by default")
+    parser.add_argument("--rate-burst", type=int, default=ClientLimiter.BURST,
+                        help="requests a client address can send at once after being idle, with --rate-limit")
+    parser.add_argument("--client-connections", type=int,
+                        help="maximum open connections of every client address, new ones are answered with 429; "
+                             "unlimited by default")
+    arguments = parser.parse_args()
+    create_server = functools.partial(AsyncHttpServer if arguments.engine == "asyncio" else HttpServer,
+                                      durability=arguments.durability, stage_timing=arguments.stage_timing,
+                                      profile_path=arguments.profile_path,
+                                      index_docroot=not arguments.no_document_index,
+                                      max_connections=arguments.max_connections, rate_limit=arguments.rate_limit,
+                                      rate_burst=arguments.rate_burst, client_connections=arguments.client_connections)
+    ServerLog.configure(getattr(logging, arguments.log_level), arguments.access_log_sample)
+    SamplingProfiler.directory = arguments.profile_directory
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, SamplingProfiler.handle_signal)
+
+    try:
+        if arguments.processes > 1:
+            PreforkServer(arguments.processes, create_server).run()
+        else:
+            server = create_server()
+            server.connect()
+            server.loop()
+    finally:
+        ServerLog.stop()